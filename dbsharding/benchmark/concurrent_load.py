@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Sequence
+from benchmark.data_generator import DataGenerator, KeySampler, UserIdSpace
+from benchmark.load_test import CONFIG_PATH, DATABASES
+from sharding.histogram import LatencyHistogram
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class WorkerStats:
+    """Per worker counters, merged after the run so workers never share a lock"""
+
+    def __init__(self):
+        self.latencies: dict[str, LatencyHistogram] = {'read': LatencyHistogram(), 'write': LatencyHistogram()}
+        self.errors: dict[str, int] = {'read': 0, 'write': 0}
+        self.timeline: dict[int, dict[str, int]] = {}
+
+
+class ConcurrentLoadTester:
+    """Multi-threaded load generator with a read/write mix, latency histograms and a throughput timeline.
+
+    Works against any backend with the SingleDatabase API, the same object is shared by all workers.
+    Reads pick keys from key_space, a list of ids or a UserIdSpace, with the given access distribution.
+    """
+
+    def __init__(self, db, key_space: Sequence[int], workers: int = 8, duration: float = 30, warmup: float = 5,
+                 read_ratio: float = 0.9, first_write_id: int|None = None, seed: int|None = None,
+                 distribution: str = 'uniform', **sampler_options):
+        self.db = db
+        self.key_space = key_space
+        self.workers = workers
+        self.duration = duration
+        self.warmup = warmup
+        self.read_ratio = read_ratio
+        self.seed = seed
+        self.distribution = distribution
+        self.sampler_options = sampler_options
+        start_id = first_write_id if first_write_id is not None else max(key_space, default=0) + 1
+        self._write_ids = itertools.count(start_id)
+
+    def _sampler(self, index: int) -> tuple[random.Random, KeySampler|None]:
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        sampler = KeySampler(len(self.key_space), self.distribution, rng.getrandbits(64), **self.sampler_options) if self.key_space else None
+        return rng, sampler
+
+    def _next_operation(self, rng: random.Random, sampler: KeySampler|None) -> tuple[str, int]:
+        """Pick a read of an existing key or a write of a new user id"""
+        if sampler is not None and rng.random() < self.read_ratio:
+            return 'read', self.key_space[sampler.sample()]
+        return 'write', next(self._write_ids)
+
+    @staticmethod
+    def _record(stats: WorkerStats, operation: str, ok: bool, op_start: float, op_end: float, measure_from: float):
+        if op_start < measure_from:
+            return
+        stats.latencies[operation].record(op_end - op_start)
+        if not ok:
+            stats.errors[operation] += 1
+        second = stats.timeline.setdefault(int(op_end - measure_from), {'read': 0, 'write': 0})
+        second[operation] += 1
+
+    def _worker(self, index: int, start_time: float, stats: WorkerStats):
+        rng, sampler = self._sampler(index)
+        measure_from = start_time + self.warmup
+        end_time = measure_from + self.duration
+        while True:
+            op_start = time.perf_counter()
+            if op_start >= end_time:
+                return
+            operation, user_id = self._next_operation(rng, sampler)
+            try:
+                if operation == 'read':
+                    # reads only pick existing keys, so a missing user is a failed read
+                    ok = self.db.get_user(user_id) is not None
+                else:
+                    ok = self.db.insert_user(user_id, DataGenerator.generate_username(user_id), DataGenerator.generate_email(user_id))
+            except Exception as e:
+                logger.error(f"{operation} of user {user_id} raised {e!r}")
+                ok = False
+            self._record(stats, operation, ok, op_start, time.perf_counter(), measure_from)
+
+    def run(self) -> dict[str, Any]:
+        logger.info(f"running {self.workers} workers for {self.warmup}s warm-up + {self.duration}s, read ratio {self.read_ratio}")
+        worker_stats = [WorkerStats() for _ in range(self.workers)]
+        instrumentation = getattr(self.db, 'instrumentation', None)
+        start_time = time.perf_counter()
+        threads = [threading.Thread(target=self._worker, args=(i, start_time, worker_stats[i])) for i in range(self.workers)]
+        if instrumentation is not None:
+            # leave the warm-up calls out of the data layer breakdown too
+            threads.append(threading.Timer(self.warmup, instrumentation.reset))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(worker_stats)
+
+    def report(self, worker_stats: list[WorkerStats]) -> dict[str, Any]:
+        operations = {}
+        total_ops = 0
+        for operation in ('read', 'write'):
+            histogram = LatencyHistogram()
+            for stats in worker_stats:
+                histogram.merge(stats.latencies[operation])
+            total_ops += histogram.count
+            operations[operation] = {
+                **histogram.summary(),
+                'errors': sum(stats.errors[operation] for stats in worker_stats),
+                'ops_per_second': histogram.count / self.duration if self.duration > 0 else 0
+            }
+
+        timeline: dict[int, dict[str, int]] = {}
+        for stats in worker_stats:
+            for second, counts in stats.timeline.items():
+                merged = timeline.setdefault(second, {'read': 0, 'write': 0})
+                merged['read'] += counts['read']
+                merged['write'] += counts['write']
+
+        return {
+            'backend': type(self.db).__name__,
+            'workers': self.workers,
+            'duration': self.duration,
+            'warmup': self.warmup,
+            'read_ratio': self.read_ratio,
+            'distribution': self.distribution,
+            'ops_per_second': total_ops / self.duration if self.duration > 0 else 0,
+            'operations': operations,
+            'throughput': [{'second': second, **timeline[second]} for second in sorted(timeline)],
+            'data_layer': self.db.instrumentation.snapshot() if hasattr(self.db, 'instrumentation') else None
+        }
+
+
+class AsyncConcurrentLoadTester(ConcurrentLoadTester):
+    """Same workload driven by asyncio tasks instead of threads, for backends with async methods like AsyncSingleDatabase"""
+
+    async def _task(self, index: int, start_time: float, stats: WorkerStats):
+        rng, sampler = self._sampler(index)
+        measure_from = start_time + self.warmup
+        end_time = measure_from + self.duration
+        while True:
+            op_start = time.perf_counter()
+            if op_start >= end_time:
+                return
+            operation, user_id = self._next_operation(rng, sampler)
+            try:
+                if operation == 'read':
+                    ok = await self.db.get_user(user_id) is not None
+                else:
+                    ok = await self.db.insert_user(user_id, DataGenerator.generate_username(user_id), DataGenerator.generate_email(user_id))
+            except Exception as e:
+                logger.error(f"{operation} of user {user_id} raised {e!r}")
+                ok = False
+            self._record(stats, operation, ok, op_start, time.perf_counter(), measure_from)
+
+    async def run_async(self) -> dict[str, Any]:
+        logger.info(f"running {self.workers} tasks for {self.warmup}s warm-up + {self.duration}s, read ratio {self.read_ratio}")
+        task_stats = [WorkerStats() for _ in range(self.workers)]
+        instrumentation = getattr(self.db, 'instrumentation', None)
+        if instrumentation is not None:
+            # leave the warm-up calls out of the data layer breakdown too
+            asyncio.get_running_loop().call_later(self.warmup, instrumentation.reset)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(self._task(i, start_time, task_stats[i]) for i in range(self.workers)))
+        return {**self.report(task_stats), 'mode': 'async'}
+
+    def run(self) -> dict[str, Any]:
+        return asyncio.run(self.run_async())
+
+
+def load_backend(name: str, config_path: str):
+    """Connect to a backend by key in DATABASES or by a module:Class path taking the config path"""
+    if name in DATABASES:
+        _, db_class = DATABASES[name]
+    else:
+        module_name, class_name = name.split(':')
+        db_class = getattr(importlib.import_module(module_name), class_name)
+    return db_class(config_path)
+
+
+async def run_async_mode(args, id_space: UserIdSpace) -> dict[str, Any]:
+    from sharding.async_db import AsyncSingleDatabase
+
+    db = await AsyncSingleDatabase.connect(args.config)
+    await db.clear_users()
+    for batch in DataGenerator.generate_user_batches(id_space, 10000, args.seed):
+        await db.insert_batch_users(batch)
+
+    tester = AsyncConcurrentLoadTester(db, id_space, args.workers, args.duration, args.warmup, args.read_ratio,
+                                       first_write_id=id_space.max_user_id + 1, seed=args.seed, distribution=args.distribution,
+                                       zipf_exponent=args.zipf_exponent, hot_fraction=args.hot_fraction,
+                                       hot_probability=args.hot_probability)
+    result = await tester.run_async()
+    await db.close_connection()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent read/write load against a database backend")
+    parser.add_argument('--backend', default='single', help="single, sharded or module:Class, ignored in async mode")
+    parser.add_argument('--mode', default='threads', choices=('threads', 'async'),
+                        help="threads drive a sync backend, async drives AsyncSingleDatabase with one task per worker")
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--workers', type=int, default=8, help="worker threads, or concurrent tasks in async mode")
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--read-ratio', type=float, default=0.9)
+    parser.add_argument('--preload', type=int, default=10000, help="users inserted before the run, reads pick from them")
+    parser.add_argument('--max-user-id', type=int, default=None, help="preloaded ids are scattered over [1, max-user-id]")
+    parser.add_argument('--distribution', default='uniform', choices=KeySampler.DISTRIBUTIONS)
+    parser.add_argument('--zipf-exponent', type=float, default=0.99)
+    parser.add_argument('--hot-fraction', type=float, default=0.2, help="share of the keys that are hot (hotspot)")
+    parser.add_argument('--hot-probability', type=float, default=0.8, help="share of the reads that go to hot keys (hotspot)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', default=None, help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    id_space = UserIdSpace(args.preload, args.max_user_id or args.preload * 10, args.seed)
+    if args.mode == 'async':
+        result = asyncio.run(run_async_mode(args, id_space))
+    else:
+        db = load_backend(args.backend, args.config)
+        db.clear_users()
+        for batch in DataGenerator.generate_user_batches(id_space, 10000, args.seed):
+            db.insert_batch_users_parallel(batch)
+
+        tester = ConcurrentLoadTester(db, id_space, args.workers, args.duration, args.warmup, args.read_ratio,
+                                      first_write_id=id_space.max_user_id + 1, seed=args.seed, distribution=args.distribution,
+                                      zipf_exponent=args.zipf_exponent, hot_fraction=args.hot_fraction,
+                                      hot_probability=args.hot_probability)
+        result = tester.run()
+        db.close_connection()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"results written to {args.json}")
+    else:
+        print(json.dumps(result, indent=2))
@@ -1,16 +1,114 @@
+import math
 import random
+from typing import Iterator
+
+class UserIdSpace:
+    """Lazy sequence of num_users unique user ids scattered over [1, max_user_id].
+
+    The i-th id is an affine permutation of i, so ids are generated on demand without materialising
+    the id range and the same seed always yields the same ids in the same order.
+    """
+
+    def __init__(self, num_users: int, max_user_id: int|None = None, seed: int|None = None):
+        self.num_users = num_users
+        self.max_user_id = max_user_id if max_user_id is not None else num_users * 2
+        if num_users > self.max_user_id:
+            raise ValueError(f"cannot draw {num_users} unique ids from {self.max_user_id}")
+        rng = random.Random(seed)
+        m = self.max_user_id
+        self._multiplier = rng.randrange(1, m) if m > 1 else 1
+        while math.gcd(self._multiplier, m) != 1:
+            self._multiplier = rng.randrange(1, m)
+        self._offset = rng.randrange(m)
+
+    def __len__(self) -> int:
+        return self.num_users
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < self.num_users:
+            raise IndexError(index)
+        return (self._multiplier * index + self._offset) % self.max_user_id + 1
+
+
+class ZipfSampler:
+    """Rejection-inversion sampler of Zipf distributed ranks in [1, n], constant time and memory per sample"""
+
+    def __init__(self, n: int, exponent: float = 0.99, rng: random.Random|None = None):
+        if exponent <= 0:
+            raise ValueError("zipf exponent must be positive")
+        self.n = n
+        self.exponent = exponent
+        self.rng = rng or random.Random()
+        self._h_integral_x1 = self._h_integral(1.5) - 1.0
+        self._h_integral_n = self._h_integral(n + 0.5)
+        self._s = 2.0 - self._h_integral_inverse(self._h_integral(2.5) - self._h(2.0))
+
+    def _h(self, x: float) -> float:
+        return math.exp(-self.exponent * math.log(x))
+
+    def _h_integral(self, x: float) -> float:
+        log_x = math.log(x)
+        return self._expm1_over_x((1.0 - self.exponent) * log_x) * log_x
+
+    def _h_integral_inverse(self, x: float) -> float:
+        t = max(x * (1.0 - self.exponent), -1.0)
+        return math.exp(self._log1p_over_x(t) * x)
+
+    @staticmethod
+    def _expm1_over_x(x: float) -> float:
+        return math.expm1(x) / x if abs(x) > 1e-8 else 1.0 + x * 0.5 * (1.0 + x / 3.0 * (1.0 + 0.25 * x))
+
+    @staticmethod
+    def _log1p_over_x(x: float) -> float:
+        return math.log1p(x) / x if abs(x) > 1e-8 else 1.0 - x * (0.5 - x * (1.0 / 3.0 - 0.25 * x))
+
+    def sample(self) -> int:
+        while True:
+            u = self._h_integral_n + self.rng.random() * (self._h_integral_x1 - self._h_integral_n)
+            x = self._h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), self.n)
+            if k - x <= self._s or u >= self._h_integral(k + 0.5) - self._h(k):
+                return k
+
+
+class KeySampler:
+    """Draws indexes in [0, size) from a uniform, zipfian or hotspot access distribution"""
+
+    DISTRIBUTIONS = ('uniform', 'zipfian', 'hotspot')
+
+    def __init__(self, size: int, distribution: str = 'uniform', seed: int|None = None, zipf_exponent: float = 0.99,
+                 hot_fraction: float = 0.2, hot_probability: float = 0.8):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"unknown distribution {distribution}, expected one of {self.DISTRIBUTIONS}")
+        self.size = size
+        self.distribution = distribution
+        self.rng = random.Random(seed)
+        self.hot_size = max(1, int(size * hot_fraction))
+        self.hot_probability = hot_probability
+        self.zipf = ZipfSampler(size, zipf_exponent, self.rng) if distribution == 'zipfian' else None
+
+    def sample(self) -> int:
+        if self.distribution == 'zipfian':
+            return self.zipf.sample() - 1
+        if self.distribution == 'hotspot' and self.hot_size < self.size:
+            if self.rng.random() < self.hot_probability:
+                return self.rng.randrange(self.hot_size)
+            return self.rng.randrange(self.hot_size, self.size)
+        return self.rng.randrange(self.size)
+
 
 class DataGenerator:
     """Generate data for benchmark testing"""
 
+    DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.com']
+
     @staticmethod
     def generate_username(user_id: int) -> str:
         return f"user_{user_id}"
 
     @staticmethod
-    def generate_email(user_id: int) -> str:
-        domains = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.com']
-        domain = random.choice(domains)
+    def generate_email(user_id: int, rng: random.Random|None = None) -> str:
+        domain = (rng or random).choice(DataGenerator.DOMAINS)
         return f"user_{user_id}@{domain}"
 
     @staticmethod
@@ -24,9 +122,39 @@ class DataGenerator:
 
         return users
 
+    @staticmethod
+    def generate_user_batches(id_space: UserIdSpace, batch_size: int = 1000,
+                              seed: int|None = None) -> Iterator[list[tuple[int, str, str]]]:
+        """Yield the users of an id space in batches, only one batch is held in memory"""
+        rng = random.Random(seed)
+        for start in range(0, len(id_space), batch_size):
+            batch = []
+            for index in range(start, min(start + batch_size, len(id_space))):
+                user_id = id_space[index]
+                batch.append((user_id, DataGenerator.generate_username(user_id), DataGenerator.generate_email(user_id, rng)))
+            yield batch
+
+    @staticmethod
+    def generate_read_keys(id_space: UserIdSpace, count: int, distribution: str = 'uniform', seed: int|None = None,
+                           batch_size: int = 1000, **sampler_options) -> Iterator[list[int]]:
+        """Yield count user ids of the id space, drawn from the access distribution, in batches"""
+        sampler = KeySampler(len(id_space), distribution, seed, **sampler_options)
+        for start in range(0, count, batch_size):
+            yield [id_space[sampler.sample()] for _ in range(min(batch_size, count - start))]
+
 if __name__ == '__main__':
     print("Testing data generation script")
     print("generating 10 users")
     users = DataGenerator.generate_random_users(10, 1000)
     for user in users:
         print(f"user detail is {user}")
+
+    print("generating 10 users from a seeded id space of 100 million")
+    id_space = UserIdSpace(100_000_000, 1_000_000_000, seed=42)
+    for batch in DataGenerator.generate_user_batches(id_space, batch_size=5, seed=42):
+        print(f"batch is {batch}")
+        break
+
+    for distribution in KeySampler.DISTRIBUTIONS:
+        keys = next(DataGenerator.generate_read_keys(id_space, 10, distribution, seed=42))
+        print(f"{distribution} read keys are {keys}")
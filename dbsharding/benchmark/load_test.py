@@ -1,51 +1,59 @@
 import logging
+import random
 import time
+from sharding.batch import failed_users
 from sharding.single_db import SingleDatabase
+from sharding.sharded_db import ShardedDatabase
 from benchmark.data_generator import DataGenerator
 
 logger = logging.basicConfig(level = logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONFIG_PATH = 'config/sharding-config.yaml'
+
+DATABASES = {
+    'single': ('Single Database', SingleDatabase),
+    'sharded': ('Sharded Database', ShardedDatabase),
+}
+
 class LoadTester:
 
     def __init__(self, num_users: int = 99999, batch_size: int = 1000):
         self.num_users = num_users
         self.batch_size = batch_size
 
+    def connect(self, type: str):
+        _, db_class = DATABASES[type]
+        return db_class(CONFIG_PATH)
+
     def clear_database(self, type: str):
-        if type == 'single':
-            db = SingleDatabase('config/sharding-config.yaml')
-            cursor = None
-            try:
-                cursor = db.connection.cursor()
-                query = "delete from users"
-                cursor.execute(query)
-                db.connection.commit()
-            except db.connection.DatabaseError as e:
-                logger.error(f"clear database failed with {e}")
-                return
-            finally:
-                if cursor is not None:
-                    cursor.close()
-                db.close_connection()
-                    
-    def benchmark_single_db(self) -> dict:
-        self.clear_database('single')
+        db = self.connect(type)
+        try:
+            if not db.clear_users():
+                logger.error(f"clear database failed for {type}")
+        finally:
+            db.close_connection()
+
+    def benchmark_db(self, type: str) -> dict:
+        database_type, _ = DATABASES[type]
+        self.clear_database(type)
 
         users = DataGenerator.generate_random_users(self.num_users)
         logger.info(f"no of users generated is {len(users)}")
 
-        db = SingleDatabase('config/sharding-config.yaml')
+        db = self.connect(type)
         logger.info(f"benchmark insertion for {self.num_users} and with batch size {self.batch_size}")
 
         start_time = time.time()
 
-        for i in range(0, len(users), self.batch_size):
-            batch = users[i:i+self.batch_size]
-            db.insert_batch_users(batch)
+        results = db.insert_batch_users_parallel(users, self.batch_size)
 
         insert_time = time.time() - start_time
-        logger.info(f"insert completed in {insert_time}:.2f seconds")
+        logger.info(f"insert completed in {insert_time:.2f} seconds")
+
+        failed_partitions = [result for result in results if not result.success]
+        if failed_partitions:
+            logger.error(f"{len(failed_partitions)} of {len(results)} partitions failed, {len(failed_users(results))} users not inserted")
 
         logger.info(f"retrieving random users")
 
@@ -57,25 +65,109 @@ class LoadTester:
 
         read_time = time.time() - start_time
 
-        logger.info(f"read {len(sample_user_ids)} in {read_time}.4f seconds")
+        logger.info(f"read {len(sample_user_ids)} in {read_time:.4f} seconds")
+
+        start_time = time.time()
+        for userid in sample_user_ids:
+            db.get_user(userid)
+        cached_read_time = time.time() - start_time
+        cache_stats = db.cache_stats()
+        if cache_stats is not None:
+            logger.info(f"re-read {len(sample_user_ids)} in {cached_read_time:.4f} seconds, cache hit ratio {cache_stats['hit_ratio']:.2%}")
+
+        multi_get_ids = [user[0] for user in random.sample(users, min(1000, len(users)))]
+        start_time = time.time()
+        found = db.get_users(multi_get_ids) or {}
+        multi_get_time = time.time() - start_time
+        missing = sum(1 for user in found.values() if user is None)
+        logger.info(f"multi-get of {len(multi_get_ids)} users took {multi_get_time:.4f} seconds, {missing} missing")
+
+        sample_emails = [users[i][2] for i in range(0, len(users), len(users)//10)]
+        start_time = time.time()
+        for email in sample_emails:
+            db.get_user_by_email(email)
+        email_read_time = time.time() - start_time
+        logger.info(f"read {len(sample_emails)} users by email in {email_read_time:.4f} seconds")
+
+        logger.info(f"scanning all users in chunks of {self.batch_size}")
+        start_time = time.time()
+        scanned = sum(len(chunk) for chunk in db.scan_users(self.batch_size))
+        scan_time = time.time() - start_time
+        logger.info(f"scanned {scanned} users in {scan_time:.2f} seconds")
 
         count = db.get_user_count()
         logger.info(f"total no of users in the database is {count}")
+        instrumentation = db.instrumentation.snapshot()
+        for operation, stats in instrumentation['operations'].items():
+            logger.info(f"{operation}: {stats['count']} calls, p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, {stats['errors']} errors")
         db.close_connection()
 
         return {
-            'database_type': 'Single Database',
+            'database_type': database_type,
             'num_of_users': self.num_users,
             'batch_size': self.batch_size,
+            'partitions': len(results),
+            'failed_partitions': len(failed_partitions),
             'insert_time': insert_time,
             'read_time': read_time,
+            'cached_read_time': cached_read_time,
+            'cache_stats': cache_stats,
+            'multi_get_time': multi_get_time,
+            'email_read_time': email_read_time,
+            'scan_time': scan_time,
             'writes_per_second': self.num_users/ insert_time if insert_time > 0 else 0,
             'reads_per_second': len(sample_user_ids)/ read_time if read_time > 0 else 0,
-            'final_count': count
+            'multi_get_reads_per_second': len(multi_get_ids)/ multi_get_time if multi_get_time > 0 else 0,
+            'scanned_rows_per_second': scanned/ scan_time if scan_time > 0 else 0,
+            'final_count': count,
+            'instrumentation': instrumentation
         }
 
+    def benchmark_bulk_load(self, type: str = 'single') -> dict:
+        """Compare the executemany batch path with the multi-row values and load data infile bulk paths"""
+        users = DataGenerator.generate_random_users(self.num_users)
+        results = {}
+        for name, options in (('executemany', None),
+                              ('values', {'method': 'values'}),
+                              ('values_deferred_indexes', {'method': 'values', 'defer_indexes': True}),
+                              ('infile', {'method': 'infile'}),
+                              ('infile_deferred_indexes', {'method': 'infile', 'defer_indexes': True})):
+            self.clear_database(type)
+            db = self.connect(type)
+            try:
+                if options is None:
+                    start_time = time.time()
+                    for i in range(0, len(users), self.batch_size):
+                        db.insert_batch_users(users[i:i+self.batch_size])
+                    load_time = time.time() - start_time
+                    results[name] = {'rows': len(users), 'load_time': load_time,
+                                     'rows_per_second': len(users) / load_time if load_time > 0 else 0}
+                else:
+                    batches = (users[i:i+self.batch_size] for i in range(0, len(users), self.batch_size))
+                    results[name] = db.bulk_load_users(batches, **options)
+            finally:
+                db.close_connection()
+            logger.info(f"{name} loaded at {results[name]['rows_per_second']:.0f} rows per second")
+        return results
+
+    def benchmark_single_db(self) -> dict:
+        return self.benchmark_db('single')
+
+    def benchmark_sharded_db(self) -> dict:
+        return self.benchmark_db('sharded')
+
 
 if __name__ == '__main__':
     tester = LoadTester()
-    result = tester.benchmark_single_db()
-    logger.info(f"benchmark result for single database is {result}")
+    single_result = tester.benchmark_single_db()
+    logger.info(f"benchmark result for single database is {single_result}")
+    sharded_result = tester.benchmark_sharded_db()
+    logger.info(f"benchmark result for sharded database is {sharded_result}")
+
+    speedup = sharded_result['writes_per_second'] / single_result['writes_per_second'] if single_result['writes_per_second'] > 0 else 0
+    logger.info(f"sharded writes per second is {speedup:.2f}x the single database")
+
+    bulk_result = tester.benchmark_bulk_load('single')
+    logger.info(f"bulk load result for single database is {bulk_result}")
+    sharded_bulk_result = tester.benchmark_bulk_load('sharded')
+    logger.info(f"bulk load result for sharded database is {sharded_bulk_result}")
@@ -0,0 +1,6 @@
+create table if not exists user_lookup (
+	attribute varchar(16) not null,
+	value varchar(255) not null,
+	user_id bigint not null,
+	primary key (attribute, value, user_id)
+) ENGINE = InnoDB;
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import yaml
+import aiomysql
+import pymysql
+from typing import Any, AsyncIterator
+from sharding.instrumentation import Instrumentation
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# aiomysql raises RuntimeError when acquiring from a closed pool
+DATABASE_ERRORS = (pymysql.err.MySQLError, RuntimeError)
+
+async def rollback(conn):
+    """Roll back, a connection which cannot is still in its transaction and the pool closes it on release"""
+    try:
+        await conn.rollback()
+    except pymysql.err.MySQLError:
+        pass
+
+
+class AsyncSingleDatabase:
+    """Asyncio counterpart of SingleDatabase, all the queries are multiplexed over an aiomysql pool.
+
+    Create it with `await AsyncSingleDatabase.connect(...)` from inside the event loop that uses it.
+    """
+
+    def __init__(self, pool: aiomysql.Pool, name: str = 'single-db', instrumentation: Instrumentation|None = None):
+        self.pool = pool
+        self.name = name
+        self.instrumentation = instrumentation or Instrumentation()
+
+    @classmethod
+    async def connect(cls, config_path: str = "../config/sharding-config.yaml",
+                      db_config: dict[str, Any]|None = None) -> 'AsyncSingleDatabase':
+        if db_config is None:
+            with open(config_path, 'r') as f:
+                config = yaml.safe_load(f)
+            db_config = config['single-db']
+
+        pool_config = db_config.get('pool') or {}
+        pool = await aiomysql.create_pool(
+            host = db_config['host'],
+            port = db_config['port'],
+            user = db_config['user'],
+            password = db_config['password'],
+            db = db_config['database'],
+            minsize = 1,
+            maxsize = pool_config.get('size', 1),
+            pool_recycle = pool_config.get('validate-after', 30),
+            autocommit = False,
+            auth_plugin = db_config['auth']
+        )
+        name = db_config.get('name', 'single-db')
+        logger.info(f"async connection pool of size {pool.maxsize} created for database {name}")
+        return cls(pool, name, Instrumentation.from_config(db_config))
+
+    def _track(self, operation: str, statement: str):
+        return self.instrumentation.track(operation, self.name, statement)
+
+    async def insert_user(self, user_id: int, username: str, email: str) -> bool:
+        """Insert a single user. Returns True on success, False on failure."""
+        query = """
+            insert into users(user_id, username, email)
+            values(%s, %s, %s)
+        """
+        with self._track('insert_user', query) as event:
+            try:
+                async with self.pool.acquire() as conn:
+                    try:
+                        async with conn.cursor() as cursor:
+                            await cursor.execute(query, (user_id, username, email))
+                            event.rows = cursor.rowcount
+                        await conn.commit()
+                    except pymysql.err.MySQLError:
+                        await rollback(conn)
+                        raise
+                return True
+            except pymysql.err.IntegrityError as e:
+                event.fail(e)
+                logger.error(f"Integrity error while inserting user {user_id}: {e}")
+                return False
+            except DATABASE_ERRORS as e:
+                event.fail(e)
+                logger.error(f"Database error while inserting user {user_id}: {e}")
+                return False
+
+    async def insert_batch_users(self, users: list[tuple[int, str, str]]) -> bool:
+        """Insert a multiple users"""
+        query = """
+            insert into users(user_id, username, email)
+            values(%s, %s, %s)
+        """
+        with self._track('insert_batch_users', query) as event:
+            try:
+                async with self.pool.acquire() as conn:
+                    try:
+                        async with conn.cursor() as cursor:
+                            await cursor.executemany(query, users)
+                            event.rows = cursor.rowcount
+                        await conn.commit()
+                    except pymysql.err.MySQLError:
+                        await rollback(conn)
+                        raise
+                return True
+            except DATABASE_ERRORS as e:
+                event.fail(e)
+                logger.error(f"insert failed with error {e}")
+                return False
+
+    async def get_user(self, user_id: int) -> dict[str, Any]|None:
+        """Retrieve a user by User ID"""
+        query = "select * from users where user_id = %s"
+        with self._track('get_user', query) as event:
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.cursor(aiomysql.DictCursor) as cursor:
+                        await cursor.execute(query, (user_id,))
+                        user = await cursor.fetchone()
+                event.rows = 1 if user is not None else 0
+                return user
+            except DATABASE_ERRORS as e:
+                event.fail(e)
+                logger.error(f"get_user failed for user id {user_id} with error: {e}")
+                return None
+
+    async def get_users(self, user_ids: list[int], chunk_size: int = 500) -> dict[int, dict[str, Any]|None]|None:
+        """Retrieve many users with chunked `in (...)` queries run concurrently.
+
+        Returns a dict keyed by every requested user id, missing users map to None.
+        Returns None if any chunk fails.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        chunks = [user_ids[i:i+chunk_size] for i in range(0, len(user_ids), chunk_size)]
+        users: dict[int, dict[str, Any]|None] = dict.fromkeys(user_ids)
+        for rows in await asyncio.gather(*(self._get_users_chunk(chunk) for chunk in chunks)):
+            if rows is None:
+                return None
+            for row in rows:
+                users[row['user_id']] = row
+        return users
+
+    async def _get_users_chunk(self, user_ids: list[int]) -> list[dict[str, Any]]|None:
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        query = f"select * from users where user_id in ({placeholders})"
+        with self._track('get_users', query) as event:
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.cursor(aiomysql.DictCursor) as cursor:
+                        await cursor.execute(query, tuple(user_ids))
+                        rows = list(await cursor.fetchall())
+                event.rows = len(rows)
+                return rows
+            except DATABASE_ERRORS as e:
+                event.fail(e)
+                logger.error(f"get_users failed for {len(user_ids)} user ids with error: {e}")
+                return None
+
+    async def get_user_count(self) -> tuple[int|None, bool]:
+        """Fetch the number of users in the database"""
+        query = "select count(*) from users"
+        with self._track('get_user_count', query) as event:
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(query)
+                        count = (await cursor.fetchone())[0]
+                event.rows = 1
+                return (count, True)
+            except DATABASE_ERRORS as e:
+                event.fail(e)
+                logger.error(f"count fetch failed with error : {e}")
+                return (None, False)
+
+    async def scan_users(self, chunk_size: int = 1000, start_after: int|None = None) -> AsyncIterator[list[dict[str, Any]]]:
+        """Stream the users in user id order over an unbuffered server side cursor, chunk_size rows at a time"""
+        if start_after is None:
+            query, params = "select * from users order by user_id", None
+        else:
+            query, params = "select * from users where user_id > %s order by user_id", (start_after,)
+        try:
+            async with self.pool.acquire() as conn:
+                cursor = await conn.cursor(aiomysql.SSDictCursor)
+                try:
+                    with self._track('scan_users', query):
+                        await cursor.execute(query, params)
+                    while True:
+                        with self._track('scan_users_fetch', query) as event:
+                            rows = await cursor.fetchmany(chunk_size)
+                            event.rows = len(rows)
+                        if not rows:
+                            break
+                        yield list(rows)
+                finally:
+                    await cursor.close()
+        except DATABASE_ERRORS as e:
+            logger.error(f"scan failed with error : {e}")
+            raise
+
+    async def clear_users(self) -> bool:
+        """Delete all the users in the database"""
+        query = "delete from users"
+        with self._track('clear_users', query) as event:
+            try:
+                async with self.pool.acquire() as conn:
+                    try:
+                        async with conn.cursor() as cursor:
+                            await cursor.execute(query)
+                            event.rows = cursor.rowcount
+                        await conn.commit()
+                    except pymysql.err.MySQLError:
+                        await rollback(conn)
+                        raise
+                return True
+            except DATABASE_ERRORS as e:
+                event.fail(e)
+                logger.error(f"clear users failed with {e}")
+                return False
+
+    async def close_connection(self):
+        """Close the pooled database connections"""
+        self.pool.close()
+        await self.pool.wait_closed()
+        logger.info(f"database connections closed for {self.name}")
+
+
+async def main():
+    logger.info("Start testing async Single database")
+    db = await AsyncSingleDatabase.connect()
+    users = [(i, f"test{i:03d}", f"test{i:03d}@example.com") for i in range(1, 101)]
+    if await db.insert_batch_users(users):
+        logger.info("users inserted")
+    found = await db.get_users(list(range(1, 201)))
+    if found is not None:
+        logger.info(f"fetched {sum(1 for user in found.values() if user is not None)} of {len(found)} requested users")
+    count, success = await db.get_user_count()
+    if success:
+        logger.info(f"no of users in the database is {count}")
+    await db.close_connection()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PartitionResult:
+    """Outcome of writing one partition of a batch"""
+    shard: str
+    partition: int
+    users: list[tuple[int, str, str]]
+    success: bool
+    elapsed: float
+
+    @property
+    def rows(self) -> int:
+        return len(self.users)
+
+
+def chunk_users(users: list[tuple[int, str, str]], partition_size: int) -> list[list[tuple[int, str, str]]]:
+    """Split the user tuples into partitions of at most partition_size rows"""
+    return [users[i:i+partition_size] for i in range(0, len(users), partition_size)]
+
+
+def write_partitions(partitions: list[tuple[str, list[tuple[int, str, str]]]],
+                     writers: dict[str, Callable[[list[tuple[int, str, str]]], bool]],
+                     max_workers: int) -> list[PartitionResult]:
+    """Write the (shard, users) partitions concurrently, one result per partition in input order"""
+
+    def write(index: int, shard: str, users: list[tuple[int, str, str]]) -> PartitionResult:
+        start_time = time.perf_counter()
+        try:
+            success = writers[shard](users)
+        except Exception as e:
+            logger.error(f"partition {index} on {shard} failed with {e}")
+            success = False
+        return PartitionResult(shard, index, users, success, time.perf_counter() - start_time)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(write, index, shard, users) for index, (shard, users) in enumerate(partitions)]
+        return [future.result() for future in futures]
+
+
+def failed_users(results: list[PartitionResult]) -> list[tuple[int, str, str]]:
+    """Collect the users of the failed partitions so they can be retried"""
+    return [user for result in results if not result.success for user in result.users]
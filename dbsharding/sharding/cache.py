@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+MISSING = object()
+
+class UserCache:
+    """In-process LRU cache of user rows with a per entry TTL and negative caching of misses"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60, negative_ttl: float = 5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[int, tuple[dict[str, Any]|None, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, db_config: dict[str, Any]) -> 'UserCache|None':
+        """Build a cache from a database section of the config, None when caching is not configured"""
+        cache_config = db_config.get('cache')
+        if not cache_config:
+            return None
+        return cls(
+            max_entries = cache_config.get('max-entries', 10000),
+            ttl = cache_config.get('ttl', 60),
+            negative_ttl = cache_config.get('negative-ttl', 5)
+        )
+
+    def get(self, user_id: int) -> Any:
+        """Return the cached user (None for a cached miss) or MISSING"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                user, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return user
+                del self._entries[user_id]
+            self.misses += 1
+            return MISSING
+
+    def generation(self) -> int:
+        """Token to take before reading the database, pass it back to put()"""
+        return self._generation
+
+    def put(self, user_id: int, user: dict[str, Any]|None, generation: int, fresh_as_of: float|None = None):
+        """Cache a database read, skipped if a write invalidated keys since the read started.
+
+        fresh_as_of is the time up to which a replica read is known to include the primary's writes,
+        the read is not cached if a write was invalidated after it.
+        """
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if fresh_as_of is not None and fresh_as_of < self._invalidated_at:
+                return
+            self._entries[user_id] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_ids: list[int]):
+        """Drop the written keys from the cache"""
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.time()
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.time()
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups > 0 else 0
+            }
@@ -0,0 +1,82 @@
+import bisect
+import hashlib
+from typing import Iterable
+
+HASH_SPACE = 2 ** 64
+
+class ConsistentHashRing:
+    """Consistent hash ring with virtual nodes used to route keys to shards"""
+
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = 100):
+        self.virtual_nodes = virtual_nodes
+        self.nodes: list[str] = []
+        self._hashes: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash_key(key) -> int:
+        digest = hashlib.md5(str(key).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    def add_node(self, node: str):
+        """Place the virtual nodes of a shard on the ring"""
+        if node in self.nodes:
+            raise ValueError(f"node {node} is already on the ring")
+        self.nodes.append(node)
+        for i in range(self.virtual_nodes):
+            point = self.hash_key(f"{node}#{i}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: str):
+        """Remove all the virtual nodes of a shard from the ring"""
+        if node not in self.nodes:
+            raise ValueError(f"node {node} is not on the ring")
+        self.nodes.remove(node)
+        points = [(h, o) for h, o in zip(self._hashes, self._owners) if o != node]
+        self._hashes = [h for h, _ in points]
+        self._owners = [o for _, o in points]
+
+    def get_node(self, key) -> str:
+        """Return the shard that owns the key"""
+        return self._owner_of_hash(self.hash_key(key))
+
+    def _owner_of_hash(self, point: int) -> str:
+        if not self._hashes:
+            raise LookupError("hash ring is empty")
+        index = bisect.bisect(self._hashes, point)
+        if index == len(self._hashes):
+            index = 0
+        return self._owners[index]
+
+    def moved_ranges(self, other: 'ConsistentHashRing') -> list[tuple[int, int, str, str]]:
+        """Hash ranges [start, end) whose owner differs between this ring and other, with the old and new owner"""
+        points = sorted(set(self._hashes) | set(other._hashes))
+        if not points:
+            return []
+        bounds = [0] + points + [HASH_SPACE]
+        moved = []
+        for start, end in zip(bounds, bounds[1:]):
+            if start == end:
+                continue
+            old_owner, new_owner = self._owner_of_hash(start), other._owner_of_hash(start)
+            if old_owner != new_owner:
+                if moved and moved[-1][1] == start and moved[-1][2:] == (old_owner, new_owner):
+                    moved[-1] = (moved[-1][0], end, old_owner, new_owner)
+                else:
+                    moved.append((start, end, old_owner, new_owner))
+        return moved
+
+    def moved_fraction(self, other: 'ConsistentHashRing') -> float:
+        """Fraction of the hash space which changes owner between this ring and other"""
+        return sum(end - start for start, end, _, _ in self.moved_ranges(other)) / HASH_SPACE
+
+    def copy(self) -> 'ConsistentHashRing':
+        ring = ConsistentHashRing(virtual_nodes=self.virtual_nodes)
+        ring.nodes = list(self.nodes)
+        ring._hashes = list(self._hashes)
+        ring._owners = list(self._owners)
+        return ring
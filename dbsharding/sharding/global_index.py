@@ -0,0 +1,95 @@
+import logging
+import mysql.connector
+from typing import Any
+from sharding.instrumentation import Instrumentation
+from sharding.pool import ConnectionPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEXED_ATTRIBUTES = ('username', 'email')
+
+class GlobalIndex:
+    """Global secondary index mapping usernames and emails to user ids, kept on its own database.
+
+    Only user ids are stored, the owning shard is worked out from the hash ring, so a rebalance
+    does not have to touch the index.
+    """
+
+    def __init__(self, db_config: dict[str, Any], instrumentation: Instrumentation|None = None):
+        self.name = db_config.get('name', 'global-index')
+        self.pool = ConnectionPool.from_config(db_config)
+        self.pool.release(self.pool.acquire())
+        self.instrumentation = instrumentation or Instrumentation.from_config(db_config)
+        logger.info("connected to global index database")
+
+    @classmethod
+    def from_config(cls, sharded_config: dict[str, Any], instrumentation: Instrumentation|None = None) -> 'GlobalIndex|None':
+        """Connect to the global-index database of the sharded-db config, None when it is not configured"""
+        index_config = sharded_config.get('global-index')
+        if not index_config:
+            return None
+        return cls({'pool': sharded_config.get('pool'), **index_config}, instrumentation)
+
+    def add_users(self, users: list[tuple[int, str, str]]) -> bool:
+        """Index the username and email of the users, entries which already exist are skipped"""
+        query = """
+            insert ignore into user_lookup(attribute, value, user_id)
+            values(%s, %s, %s)
+        """
+        try:
+            with self.instrumentation.track('index_add_users', self.name, query) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    entries = [(attribute, value, user_id)
+                               for user_id, username, email in users
+                               for attribute, value in zip(INDEXED_ATTRIBUTES, (username, email))]
+                    cursor.executemany(query, entries)
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                    return True
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"index update for {len(users)} users failed with error {e}")
+            return False
+
+    def lookup(self, attribute: str, value: str) -> list[int]|None:
+        """Return the user ids indexed under the value, None if the probe fails"""
+        if attribute not in INDEXED_ATTRIBUTES:
+            raise ValueError(f"{attribute} is not indexed")
+        query = "select user_id from user_lookup where attribute = %s and value = %s"
+        try:
+            with self.instrumentation.track(f"index_lookup_{attribute}", self.name, query) as event, \
+                    self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query, (attribute, value))
+                    user_ids = [row[0] for row in cursor.fetchall()]
+                    event.rows = len(user_ids)
+                    return user_ids
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"index lookup of {attribute} failed with error {e}")
+            return None
+
+    def clear(self) -> bool:
+        """Delete every index entry"""
+        query = "delete from user_lookup"
+        try:
+            with self.instrumentation.track('index_clear', self.name, query) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query)
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                    return True
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"index clear failed with error {e}")
+            return False
+
+    def close_connection(self):
+        self.pool.close()
@@ -0,0 +1,56 @@
+import math
+from typing import Any
+
+class LatencyHistogram:
+    """Latency histogram with geometric buckets, percentiles are accurate to the bucket growth factor.
+
+    Not thread safe, give every worker its own histogram and merge them at the end.
+    """
+
+    def __init__(self, growth: float = 1.05, min_latency: float = 1e-6):
+        self.growth = growth
+        self.min_latency = min_latency
+        self._log_growth = math.log(growth)
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency: float):
+        """Record a latency in seconds"""
+        index = 0 if latency <= self.min_latency else int(math.log(latency / self.min_latency) / self._log_growth) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> float:
+        """Upper bound of the bucket holding the percentile, in seconds"""
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.min_latency * self.growth ** index, self.max)
+        return self.max
+
+    def summary(self) -> dict[str, Any]:
+        """Count, mean and p50/p95/p99/max in milliseconds"""
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count > 0 else 0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max * 1000
+        }
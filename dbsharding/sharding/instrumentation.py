@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+from sharding.histogram import LatencyHistogram
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class QueryEvent:
+    """One data layer call, passed to every instrumentation hook"""
+    operation: str
+    shard: str
+    statement: str|None = None
+    rows: int = 0
+    latency: float = 0.0
+    success: bool = True
+    error: str|None = None
+
+    def fail(self, error: Exception):
+        self.success = False
+        self.error = str(error)
+
+
+class OperationStats:
+    def __init__(self):
+        self.latencies = LatencyHistogram()
+        self.errors = 0
+        self.rows = 0
+
+    def merge(self, other: 'OperationStats'):
+        self.latencies.merge(other.latencies)
+        self.errors += other.errors
+        self.rows += other.rows
+
+    def summary(self) -> dict[str, Any]:
+        return {**self.latencies.summary(), 'errors': self.errors, 'rows': self.rows}
+
+
+class Instrumentation:
+    """Records every data layer call into per operation and per shard histograms.
+
+    Hooks are called with each QueryEvent, so other collectors can be plugged in. Calls slower than
+    slow_query_threshold seconds are logged with their statement.
+    """
+
+    def __init__(self, slow_query_threshold: float|None = None):
+        self.slow_query_threshold = slow_query_threshold
+        self.hooks: list[Callable[[QueryEvent], None]] = []
+        self._stats: dict[tuple[str, str], OperationStats] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, db_config: dict[str, Any]) -> 'Instrumentation':
+        instrumentation_config = db_config.get('instrumentation') or {}
+        slow_query_ms = instrumentation_config.get('slow-query-ms')
+        return cls(slow_query_ms / 1000 if slow_query_ms is not None else None)
+
+    def add_hook(self, hook: Callable[[QueryEvent], None]):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def track(self, operation: str, shard: str, statement: str|None = None) -> Iterator[QueryEvent]:
+        """Time the with block as one call, set rows on the event and call fail() on it when the call fails"""
+        event = QueryEvent(operation, shard, statement)
+        start_time = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event.fail(e)
+            raise
+        finally:
+            event.latency = time.perf_counter() - start_time
+            self.record(event)
+
+    def record(self, event: QueryEvent):
+        with self._lock:
+            stats = self._stats.get((event.operation, event.shard))
+            if stats is None:
+                stats = self._stats[(event.operation, event.shard)] = OperationStats()
+            stats.latencies.record(event.latency)
+            stats.rows += event.rows
+            if not event.success:
+                stats.errors += 1
+
+        if self.slow_query_threshold is not None and event.latency > self.slow_query_threshold:
+            statement = " ".join((event.statement or "").split())
+            logger.warning(f"slow query: {event.operation} on {event.shard} took {event.latency * 1000:.1f} ms, "
+                           f"{event.rows} rows: {statement}")
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.error(f"instrumentation hook failed with {e}")
+
+    def snapshot(self) -> dict[str, Any]:
+        """Latency, error and row totals per operation, and per shard and operation"""
+        with self._lock:
+            by_operation: dict[str, OperationStats] = {}
+            by_shard: dict[str, dict[str, Any]] = {}
+            for (operation, shard), stats in sorted(self._stats.items()):
+                by_operation.setdefault(operation, OperationStats()).merge(stats)
+                by_shard.setdefault(shard, {})[operation] = stats.summary()
+            return {
+                'operations': {operation: stats.summary() for operation, stats in by_operation.items()},
+                'shards': by_shard
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+import mysql.connector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PoolExhaustedError(mysql.connector.PoolError):
+    """Raised when no connection could be checked out before the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread safe pool of mysql connections with idle validation and reconnect on failure"""
+
+    def __init__(self, db_config: dict[str, Any], size: int = 1, validate_after: float = 30, checkout_timeout: float = 10):
+        self.db_config = db_config
+        self.name = db_config.get('name', 'single-db')
+        self.size = size
+        self.validate_after = validate_after
+        self.checkout_timeout = checkout_timeout
+        # idle connections with the time they were released, most recent last. Guarded by _available along with
+        # _created, which is notified whenever a connection is released or a slot frees up
+        self._idle: list[tuple[Any, float]] = []
+        self._created = 0
+        self._available = threading.Condition()
+
+    @classmethod
+    def from_config(cls, db_config: dict[str, Any]) -> 'ConnectionPool':
+        """Build a pool from a database section of the config, the pool settings are optional"""
+        pool_config = db_config.get('pool') or {}
+        return cls(
+            db_config,
+            size = pool_config.get('size', 1),
+            validate_after = pool_config.get('validate-after', 30),
+            checkout_timeout = pool_config.get('checkout-timeout', 10)
+        )
+
+    def _connect(self):
+        return mysql.connector.connect(
+            host = self.db_config['host'],
+            port = self.db_config['port'],
+            user = self.db_config['user'],
+            password = self.db_config['password'],
+            database = self.db_config['database'],
+            auth_plugin = self.db_config['auth'],
+            allow_local_infile = self.db_config.get('local-infile', False)
+        )
+
+    def _validate(self, conn):
+        """Ping a connection which sat idle for too long, reconnect if the ping fails"""
+        try:
+            conn.ping(reconnect=True, attempts=3, delay=1)
+            return conn
+        except mysql.connector.Error as e:
+            logger.warning(f"idle connection validation failed with {e}, opening a new connection")
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            return self._connect()
+
+    def acquire(self):
+        """Check out a connection, blocks up to checkout_timeout when the pool is exhausted"""
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f"no connection available after {self.checkout_timeout} seconds")
+                self._available.wait(remaining)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn = None
+                self._created += 1
+
+        if conn is None:
+            try:
+                return self._connect()
+            except mysql.connector.Error:
+                self._free_slot()
+                raise
+        if time.monotonic() - last_used > self.validate_after:
+            try:
+                conn = self._validate(conn)
+            except mysql.connector.Error:
+                self._discard(conn)
+                raise
+        return conn
+
+    def release(self, conn, broken: bool = False):
+        """Return a connection to the pool, broken connections are closed and replaced lazily"""
+        if broken:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+        self._free_slot()
+
+    def _free_slot(self):
+        # a waiter can open a new connection in its place
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Check out a connection for the duration of the with block.
+
+        When a mysql error escapes the block the open transaction is rolled back. Connections which
+        lost the server, or cannot even roll back, are dropped instead of going back to the pool.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except (mysql.connector.InterfaceError, mysql.connector.OperationalError):
+            broken = True
+            raise
+        except mysql.connector.Error:
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def close(self):
+        """Close all the idle connections in the pool"""
+        with self._available:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
@@ -0,0 +1,214 @@
+import argparse
+import logging
+import time
+from typing import Any
+from sharding.consistent_hash import ConsistentHashRing
+from sharding.replicas import Session
+from sharding.sharded_db import ShardedDatabase
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Rebalancer:
+    """Online resharding, copies only the users whose owner changes when a shard joins or leaves the ring.
+
+    While the copy runs, ShardedDatabase keeps routing reads and writes by the current ring and also
+    writes new users to their owner on the target ring. Users whose dual write failed are copied
+    again and checked before routing flips to the target ring atomically. A moved row is deleted
+    from the shard it left only once it is confirmed on its new owner.
+    """
+
+    def __init__(self, db: ShardedDatabase, batch_size: int = 1000, max_rows_per_second: float|None = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+
+    def add_shard(self, shard_config: dict[str, Any]) -> dict[str, Any]:
+        """Connect a new shard, move its share of the users onto it and start routing to it"""
+        name = shard_config['name']
+        if name in self.db.shards:
+            raise ValueError(f"shard {name} already exists")
+        self.db.shards[name] = self.db.connect_shard(shard_config)
+        target_ring = self.db.ring.copy()
+        target_ring.add_node(name)
+        report = self.rebalance(target_ring)
+        if not report['success']:
+            self.db.shards.pop(name).close_connection()
+        return report
+
+    def remove_shard(self, name: str) -> dict[str, Any]:
+        """Move all the users off a shard, stop routing to it and close it"""
+        target_ring = self.db.ring.copy()
+        target_ring.remove_node(name)
+        report = self.rebalance(target_ring)
+        if report['success']:
+            self.db.shards.pop(name).close_connection()
+        return report
+
+    def rebalance(self, target_ring: ConsistentHashRing) -> dict[str, Any]:
+        """Copy the users whose owner differs on target_ring, then flip routing to it"""
+        db = self.db
+        source_ring = db.ring
+        report: dict[str, Any] = {
+            'source_shards': list(source_ring.nodes),
+            'target_shards': list(target_ring.nodes),
+            'expected_fraction': source_ring.moved_fraction(target_ring),
+            'rows_scanned': 0,
+            'rows_moved': 0,
+            'moves': {},
+            'dual_writes_repaired': 0,
+            'rows_not_confirmed': 0,
+            'success': False
+        }
+        logger.info(f"rebalancing {source_ring.nodes} -> {target_ring.nodes}, "
+                    f"{report['expected_fraction']:.2%} of the hash space changes owner")
+
+        db.take_dual_write_failures()
+        db.set_rings(source_ring, target_ring)
+        start_time = time.perf_counter()
+        try:
+            for shard_name in source_ring.nodes:
+                if not self._copy_shard(shard_name, source_ring, target_ring, report, start_time):
+                    db.set_rings(source_ring, None)
+                    logger.error(f"rebalance aborted while copying from {shard_name}, routing left on {source_ring.nodes}")
+                    return report
+            if not self._repair_dual_writes(source_ring, target_ring, report):
+                db.set_rings(source_ring, None)
+                logger.error(f"rebalance aborted, failed dual writes could not be copied, routing left on {source_ring.nodes}")
+                return report
+        except Exception:
+            db.set_rings(source_ring, None)
+            raise
+
+        copy_time = time.perf_counter() - start_time
+        db.set_rings(target_ring, None)
+        # dual writes which failed while the flip waited for them, the clean up keeps any still missing
+        self._repair_dual_writes(source_ring, target_ring, report)
+        report['success'] = True
+        report['copy_time'] = copy_time
+        report['rows_moved_per_second'] = report['rows_moved'] / copy_time if copy_time > 0 else 0
+        report['fraction_relocated'] = report['rows_moved'] / report['rows_scanned'] if report['rows_scanned'] > 0 else 0
+        logger.info(f"moved {report['rows_moved']} of {report['rows_scanned']} users "
+                    f"({report['fraction_relocated']:.2%}) at {report['rows_moved_per_second']:.0f} rows/s")
+
+        report['rows_cleaned_up'] = sum(self._clean_up_shard(shard_name, target_ring, report)
+                                        for shard_name in source_ring.nodes if shard_name in target_ring.nodes)
+        if report['rows_not_confirmed']:
+            logger.error(f"{report['rows_not_confirmed']} moved users were not confirmed on their new shard, "
+                         f"they were left on the shard they came from")
+        return report
+
+    def _copy_shard(self, shard_name: str, source_ring: ConsistentHashRing, target_ring: ConsistentHashRing,
+                    report: dict[str, Any], start_time: float) -> bool:
+        for rows in self.db.shards[shard_name].scan_users(self.batch_size, keyset=True):
+            report['rows_scanned'] += len(rows)
+            moving: dict[str, list[dict[str, Any]]] = {}
+            for row in rows:
+                target = target_ring.get_node(row['user_id'])
+                if source_ring.get_node(row['user_id']) == shard_name and target != shard_name:
+                    moving.setdefault(target, []).append(row)
+            for target, target_rows in moving.items():
+                if not self.db.shards[target].copy_users(target_rows):
+                    return False
+                move = f"{shard_name}->{target}"
+                report['moves'][move] = report['moves'].get(move, 0) + len(target_rows)
+                report['rows_moved'] += len(target_rows)
+            self._throttle(report['rows_moved'], start_time)
+        return True
+
+    def _repair_dual_writes(self, source_ring: ConsistentHashRing, target_ring: ConsistentHashRing,
+                            report: dict[str, Any]) -> bool:
+        """Copy the users whose dual write failed to their new owner again, True when all of them are confirmed there"""
+        failed = self.db.take_dual_write_failures()
+        by_source: dict[str, list[int]] = {}
+        for user_id in failed:
+            by_source.setdefault(source_ring.get_node(user_id), []).append(user_id)
+
+        unconfirmed = []
+        for shard_name, user_ids in by_source.items():
+            users = self.db.shards[shard_name].get_users(user_ids, session=self._primary_session())
+            if users is None:
+                unconfirmed.extend(user_ids)
+                continue
+            moving: dict[str, list[dict[str, Any]]] = {}
+            for user in users.values():
+                if user is not None:
+                    moving.setdefault(target_ring.get_node(user['user_id']), []).append(user)
+            for target, target_rows in moving.items():
+                confirmed = self._confirm_copied(target, target_rows)
+                unconfirmed.extend(row['user_id'] for row in target_rows if row['user_id'] not in confirmed)
+
+        report['dual_writes_repaired'] += len(failed) - len(unconfirmed)
+        if unconfirmed:
+            logger.error(f"{len(unconfirmed)} users whose dual write failed could not be copied to their new shard")
+            return False
+        return True
+
+    def _confirm_copied(self, target: str, rows: list[dict[str, Any]]) -> set[int]:
+        """Copy the rows their new owner is missing, returns the user ids confirmed on it"""
+        shard = self.db.shards[target]
+        confirmed = self._present_on(target, rows)
+        missing = [row for row in rows if row['user_id'] not in confirmed]
+        if missing and shard.copy_users(missing):
+            confirmed |= self._present_on(target, missing)
+        return confirmed
+
+    def _present_on(self, shard_name: str, rows: list[dict[str, Any]]) -> set[int]:
+        users = self.db.shards[shard_name].get_users([row['user_id'] for row in rows], session=self._primary_session())
+        return {user_id for user_id, user in (users or {}).items() if user is not None}
+
+    @staticmethod
+    def _primary_session() -> Session:
+        # a session which has just written is too new for any replica, so its reads go to the primary
+        session = Session()
+        session.record_write()
+        return session
+
+    def _clean_up_shard(self, shard_name: str, ring: ConsistentHashRing, report: dict[str, Any]) -> int:
+        """Delete the rows a shard no longer owns which are confirmed on their new owner, returns the number deleted"""
+        deleted = 0
+        start_time = time.perf_counter()
+        for rows in self.db.shards[shard_name].scan_users(self.batch_size, keyset=True):
+            moved: dict[str, list[dict[str, Any]]] = {}
+            for row in rows:
+                owner = ring.get_node(row['user_id'])
+                if owner != shard_name:
+                    moved.setdefault(owner, []).append(row)
+            user_ids = []
+            for owner, owner_rows in moved.items():
+                confirmed = self._confirm_copied(owner, owner_rows)
+                user_ids.extend(confirmed)
+                report['rows_not_confirmed'] += len(owner_rows) - len(confirmed)
+            if not self.db.shards[shard_name].delete_users(user_ids):
+                logger.error(f"clean up of {shard_name} stopped after deleting {deleted} rows")
+                break
+            deleted += len(user_ids)
+            self._throttle(deleted, start_time)
+        return deleted
+
+    def _throttle(self, rows: int, start_time: float):
+        if self.max_rows_per_second is None:
+            return
+        ahead = rows / self.max_rows_per_second - (time.perf_counter() - start_time)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add or remove a shard without downtime")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--add', help="name of a shard listed under sharded-db spare-shards")
+    group.add_argument('--remove', help="name of a shard to drain and remove")
+    parser.add_argument('--config', default='config/sharding-config.yaml')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--max-rows-per-second', type=float, default=None)
+    args = parser.parse_args()
+
+    db = ShardedDatabase(args.config)
+    rebalancer = Rebalancer(db, args.batch_size, args.max_rows_per_second)
+    if args.add:
+        report = rebalancer.add_shard(db.spare_shards[args.add])
+    else:
+        report = rebalancer.remove_shard(args.remove)
+    logger.info(f"rebalance report is {report}")
+    db.close_connection()
@@ -0,0 +1,115 @@
+import itertools
+import logging
+import threading
+import time
+import mysql.connector
+from typing import Any, Callable
+from sharding.pool import ConnectionPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Session:
+    """Read-your-writes session, reads skip replicas which may not have applied the session's last write"""
+
+    def __init__(self):
+        self.last_write_at: float|None = None
+
+    def record_write(self):
+        self.last_write_at = time.time()
+
+
+def measure_replica_lag(conn) -> float|None:
+    """Seconds_Behind_Source of a replica plus one, as the server rounds down to whole seconds.
+    None when replication is not running."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("show replica status")
+        status = cursor.fetchone()
+    finally:
+        cursor.close()
+    if status is None or status.get('Seconds_Behind_Source') is None:
+        return None
+    return float(status['Seconds_Behind_Source']) + 1
+
+
+class Replica:
+    """A read replica with its own pool and the replication lag measured at the last check"""
+
+    def __init__(self, name: str, pool: ConnectionPool):
+        self.name = name
+        self.pool = pool
+        self.lag: float|None = None
+        self.checked_at = 0.0
+
+    def fresh_as_of(self) -> float|None:
+        """Time up to which all the primary's writes are known to be applied on the replica"""
+        return self.checked_at - self.lag if self.lag is not None else None
+
+
+class ReplicaSet:
+    """Round-robin load balancing over the replicas whose measured lag is under the threshold.
+
+    Lag is re-measured with lag_probe at most every check_interval seconds, by whichever read
+    notices it is due. Tests can pass a stand-in lag_probe to simulate lagging replicas.
+    """
+
+    def __init__(self, replicas: list[Replica], max_lag: float = 5, check_interval: float = 1,
+                 lag_probe: Callable[[Any], float|None] = measure_replica_lag):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag_probe = lag_probe
+        self._next = itertools.count()
+        self._checking = threading.Lock()
+        self._checked_at = 0.0
+
+    @classmethod
+    def from_config(cls, db_config: dict[str, Any]) -> 'ReplicaSet|None':
+        """Build the replica set of a database section of the config, None when it has no replicas"""
+        if not db_config.get('replicas'):
+            return None
+        replicas = []
+        for index, replica_config in enumerate(db_config['replicas']):
+            replica_config = {'pool': db_config.get('pool'), 'name': f"replica-{index + 1}", **replica_config}
+            replicas.append(Replica(replica_config['name'], ConnectionPool.from_config(replica_config)))
+        lag_config = db_config.get('replica-lag') or {}
+        return cls(replicas, lag_config.get('max-lag', 5), lag_config.get('check-interval', 1))
+
+    def check_lag(self):
+        """Measure the lag of every replica, an unreachable replica counts as too far behind"""
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection() as conn:
+                    replica.lag = self.lag_probe(conn)
+            except mysql.connector.Error as e:
+                logger.warning(f"lag check failed on {replica.name} with {e}")
+                replica.lag = None
+            replica.checked_at = time.time()
+            if replica.lag is None or replica.lag > self.max_lag:
+                logger.warning(f"replica {replica.name} skipped, lag is {replica.lag}")
+
+    def _refresh(self):
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        # one reader refreshes, the others keep using the last measurement
+        if self._checking.acquire(blocking=False):
+            try:
+                self.check_lag()
+                self._checked_at = time.monotonic()
+            finally:
+                self._checking.release()
+
+    def choose(self, session: Session|None = None) -> Replica|None:
+        """Next replica in rotation within the lag threshold, and fresh enough for the session if one is given"""
+        self._refresh()
+        eligible = [replica for replica in self.replicas if replica.lag is not None and replica.lag <= self.max_lag]
+        if session is not None and session.last_write_at is not None:
+            eligible = [replica for replica in eligible if replica.fresh_as_of() >= session.last_write_at]
+        if not eligible:
+            return None
+        return eligible[next(self._next) % len(eligible)]
+
+    def close(self):
+        for replica in self.replicas:
+            replica.pool.close()
@@ -0,0 +1,373 @@
+import heapq
+import logging
+import threading
+import time
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+from sharding.batch import PartitionResult, chunk_users, write_partitions
+from sharding.consistent_hash import ConsistentHashRing
+from sharding.global_index import GlobalIndex
+from sharding.instrumentation import Instrumentation
+from sharding.replicas import Session
+from sharding.single_db import SingleDatabase
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ShardedDatabase:
+    """Sharded database implementation, routes users to shards by user id over a consistent hash ring"""
+
+    def __init__(self, config_path: str = "../config/sharding-config.yaml"):
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+
+        sharded_config = config['sharded-db']
+        self.virtual_nodes = sharded_config.get('virtual-nodes', 100)
+        self.shard_defaults = {key: sharded_config.get(key) for key in ('pool', 'cache', 'replica-lag')}
+        # one instrumentation shared by all the shards, so a snapshot breaks calls down per shard
+        self.instrumentation = Instrumentation.from_config(sharded_config)
+        self.spare_shards = {shard_config['name']: shard_config for shard_config in sharded_config.get('spare-shards') or []}
+        self.shards: dict[str, SingleDatabase] = {}
+        for shard_config in sharded_config['shards']:
+            self.shards[shard_config['name']] = self.connect_shard(shard_config)
+
+        self.ring = ConsistentHashRing(self.shards.keys(), self.virtual_nodes)
+        # while a rebalance is copying data, writes also go to the owner on target_ring
+        self.target_ring: ConsistentHashRing|None = None
+        self._routing = threading.Condition()
+        self._epoch = 0
+        self._writes_in_flight: dict[int, int] = {}
+        # users whose dual write failed, the rebalance copies them again before it flips routing
+        self._dual_write_failures: set[int] = set()
+        self.global_index = GlobalIndex.from_config(sharded_config, self.instrumentation)
+        logger.info(f"connected to {len(self.shards)} shards")
+
+    def connect_shard(self, shard_config: dict[str, Any]) -> SingleDatabase:
+        """Connect to a shard, the sharded-db pool, cache and replica-lag settings apply unless the shard overrides them"""
+        return SingleDatabase(db_config={**self.shard_defaults, **shard_config}, instrumentation=self.instrumentation)
+
+    @contextmanager
+    def _write_routing(self) -> Iterator[tuple[ConsistentHashRing, ConsistentHashRing|None]]:
+        """Pin the rings a write is routed by, so set_rings can wait for writes routed by the old rings"""
+        with self._routing:
+            epoch = self._epoch
+            rings = (self.ring, self.target_ring)
+            self._writes_in_flight[epoch] = self._writes_in_flight.get(epoch, 0) + 1
+        try:
+            yield rings
+        finally:
+            with self._routing:
+                self._writes_in_flight[epoch] -= 1
+                if self._writes_in_flight[epoch] == 0:
+                    del self._writes_in_flight[epoch]
+                self._routing.notify_all()
+
+    def set_rings(self, ring: ConsistentHashRing, target_ring: ConsistentHashRing|None):
+        """Atomically switch the routing rings, returns once no write routed by the previous rings is in flight"""
+        with self._routing:
+            self.ring, self.target_ring = ring, target_ring
+            self._epoch += 1
+            epoch = self._epoch
+            self._routing.wait_for(lambda: all(e >= epoch for e in self._writes_in_flight))
+        logger.info(f"routing switched to shards {ring.nodes}" + (f", dual writing to {target_ring.nodes}" if target_ring else ""))
+
+    def _dual_write(self, ring: ConsistentHashRing, target_ring: ConsistentHashRing|None, users: list[tuple[int, str, str]]):
+        """Copy freshly written users to their owner on the target ring when it differs"""
+        if target_ring is None:
+            return
+        moving: dict[str, list[tuple[int, str, str]]] = {}
+        for user in users:
+            target = target_ring.get_node(user[0])
+            if target != ring.get_node(user[0]):
+                moving.setdefault(target, []).append(user)
+        for target, target_users in moving.items():
+            if not self.shards[target].insert_batch_users(target_users, ignore_duplicates=True):
+                logger.error(f"dual write of {len(target_users)} users to {target} failed, the rebalance will copy them again")
+                with self._routing:
+                    self._dual_write_failures.update(user[0] for user in target_users)
+
+    def take_dual_write_failures(self) -> set[int]:
+        """Return and forget the user ids whose dual write failed"""
+        with self._routing:
+            failures, self._dual_write_failures = self._dual_write_failures, set()
+        return failures
+
+    def _after_write(self, ring: ConsistentHashRing, target_ring: ConsistentHashRing|None, users: list[tuple[int, str, str]]):
+        """Dual write during a rebalance and index the written users"""
+        self._dual_write(ring, target_ring, users)
+        if self.global_index is not None and not self.global_index.add_users(users):
+            logger.error(f"{len(users)} users written but not indexed, run rebuild_global_index to repair")
+
+    def session(self) -> Session:
+        """Start a read-your-writes session, pass it to the reads and writes that must see each other"""
+        return Session()
+
+    def get_shard(self, user_id: int) -> SingleDatabase:
+        """Return the shard which owns the user id"""
+        return self.shards[self.ring.get_node(user_id)]
+
+    def partition_users(self, users: list[tuple[int, str, str]],
+                        ring: ConsistentHashRing|None = None) -> dict[str, list[tuple[int, str, str]]]:
+        """Group the user tuples by the shard which owns them"""
+        ring = ring or self.ring
+        partitions: dict[str, list[tuple[int, str, str]]] = {}
+        for user in users:
+            partitions.setdefault(ring.get_node(user[0]), []).append(user)
+        return partitions
+
+    def insert_user(self, user_id: int, username: str, email: str, session: Session|None = None) -> bool:
+        """Insert a single user into its shard. Returns True on success, False on failure."""
+        with self._write_routing() as (ring, target_ring):
+            success = self.shards[ring.get_node(user_id)].insert_user(user_id, username, email, session)
+            if success:
+                self._after_write(ring, target_ring, [(user_id, username, email)])
+            return success
+
+    def insert_batch_users(self, users: list[tuple[int, str, str]], session: Session|None = None) -> bool:
+        """Insert multiple users, one batch per shard"""
+        success = True
+        with self._write_routing() as (ring, target_ring):
+            for shard_name, shard_users in self.partition_users(users, ring).items():
+                if self.shards[shard_name].insert_batch_users(shard_users, session=session):
+                    self._after_write(ring, target_ring, shard_users)
+                else:
+                    logger.error(f"batch insert of {len(shard_users)} users failed on {shard_name}")
+                    success = False
+        return success
+
+    def insert_batch_users_parallel(self, users: list[tuple[int, str, str]], partition_size: int = 1000,
+                                    max_workers: int|None = None, session: Session|None = None) -> list[PartitionResult]:
+        """Insert multiple users, partitioned by shard and written concurrently, one result per partition"""
+        with self._write_routing() as (ring, target_ring):
+            partitions = [(shard_name, chunk)
+                          for shard_name, shard_users in self.partition_users(users, ring).items()
+                          for chunk in chunk_users(shard_users, partition_size)]
+
+            def writer(shard: SingleDatabase):
+                def write(shard_users: list[tuple[int, str, str]]) -> bool:
+                    success = shard.insert_batch_users(shard_users, session=session)
+                    if success:
+                        self._after_write(ring, target_ring, shard_users)
+                    return success
+                return write
+
+            writers = {shard_name: writer(shard) for shard_name, shard in self.shards.items()}
+            if max_workers is None:
+                max_workers = sum(shard.pool.size for shard in self.shards.values())
+            return write_partitions(partitions, writers, max_workers)
+
+    def bulk_load_users(self, batches: Iterable[list[tuple[int, str, str]]], method: str = 'values',
+                        defer_indexes: bool = False, infile_rows: int = 100000) -> dict[str, Any]:
+        """Bulk ingest users for an initial load, every shard runs SingleDatabase.bulk_load_users on its own rows concurrently.
+
+        The batches are split by shard up front, so the whole load is held in memory. The global index and a
+        rebalance target are written once a shard's load succeeds. load_time is the wall time of the shard
+        loads including their index rebuilds, and each shard's own report is under 'shards'.
+        """
+        if method not in ('values', 'infile'):
+            raise ValueError(f"unknown bulk load method {method}")
+
+        with self._write_routing() as (ring, target_ring):
+            partitions: dict[str, list[list[tuple[int, str, str]]]] = {}
+            for batch in batches:
+                for shard_name, shard_users in self.partition_users(batch, ring).items():
+                    partitions.setdefault(shard_name, []).append(shard_users)
+
+            def load(shard_name: str) -> dict[str, Any]:
+                return self.shards[shard_name].bulk_load_users(partitions[shard_name], method, defer_indexes, infile_rows)
+
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(len(partitions), 1)) as executor:
+                reports = dict(zip(partitions, executor.map(load, partitions)))
+            load_time = time.perf_counter() - start_time
+
+            for shard_name, shard_report in reports.items():
+                if not shard_report['success']:
+                    logger.error(f"bulk load failed on {shard_name} after {shard_report['rows']} rows")
+                    continue
+                for shard_users in partitions[shard_name]:
+                    self._after_write(ring, target_ring, shard_users)
+
+        rows = sum(shard_report['rows'] for shard_report in reports.values())
+        return {
+            'method': method,
+            'defer_indexes': defer_indexes,
+            'rows': rows,
+            'statements': sum(shard_report['statements'] for shard_report in reports.values()),
+            'load_time': load_time,
+            'index_rebuild_time': max((shard_report['index_rebuild_time'] for shard_report in reports.values()), default=0.0),
+            'rows_per_second': rows / load_time if load_time > 0 else 0,
+            'success': all(shard_report['success'] for shard_report in reports.values()),
+            'shards': reports
+        }
+
+    def get_user(self, user_id: int, session: Session|None = None) -> dict[str, Any]|None:
+        """Retrieve a user by User ID from its shard"""
+        return self.get_shard(user_id).get_user(user_id, session)
+
+    def get_user_by_username(self, username: str, session: Session|None = None) -> dict[str, Any]|None:
+        """Retrieve a user by username, one global index probe plus one shard read"""
+        return self._get_user_by('username', username, session)
+
+    def get_user_by_email(self, email: str, session: Session|None = None) -> dict[str, Any]|None:
+        """Retrieve a user by email, one global index probe plus one shard read"""
+        return self._get_user_by('email', email, session)
+
+    def _get_user_by(self, attribute: str, value: str, session: Session|None = None) -> dict[str, Any]|None:
+        if self.global_index is None:
+            # no index configured, ask every shard
+            return self._scatter_get_user_by(attribute, value, session)
+
+        user_ids = self.global_index.lookup(attribute, value)
+        if user_ids is None:
+            logger.warning(f"global index lookup by {attribute} failed, asking every shard")
+            return self._scatter_get_user_by(attribute, value, session)
+        for user_id in user_ids:
+            user = self.get_user(user_id, session)
+            # the index is written after the shard, a stale entry must not return the wrong user
+            if user is not None and user[attribute] == value:
+                return user
+        return None
+
+    def _scatter_get_user_by(self, attribute: str, value: str, session: Session|None = None) -> dict[str, Any]|None:
+        for shard_name in self.ring.nodes:
+            user = getattr(self.shards[shard_name], f"get_user_by_{attribute}")(value, session)
+            if user is not None:
+                return user
+        return None
+
+    def rebuild_global_index(self, chunk_size: int = 1000) -> bool:
+        """Re-index every user from the shards, repairs index writes which failed"""
+        if self.global_index is None:
+            return False
+        for rows in self.scan_users(chunk_size, keyset=True):
+            if not self.global_index.add_users([(row['user_id'], row['username'], row['email']) for row in rows]):
+                return False
+        return True
+
+    def get_users(self, user_ids: list[int], chunk_size: int = 500, max_workers: int|None = None,
+                  session: Session|None = None) -> dict[int, dict[str, Any]|None]|None:
+        """Retrieve many users, grouped by shard and fetched from all the shards concurrently.
+
+        Returns a dict keyed by every requested user id, missing users map to None.
+        Returns None if any shard fails.
+        """
+        groups: dict[str, list[int]] = {}
+        for user_id in user_ids:
+            groups.setdefault(self.ring.get_node(user_id), []).append(user_id)
+        users: dict[int, dict[str, Any]|None] = {}
+        if not groups:
+            return users
+
+        def fetch(shard_name: str) -> dict[int, dict[str, Any]|None]|None:
+            return self.shards[shard_name].get_users(groups[shard_name], chunk_size, max_workers, session)
+
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            for shard_name, shard_users in zip(groups, executor.map(fetch, groups)):
+                if shard_users is None:
+                    logger.error(f"get_users failed on {shard_name}")
+                    return None
+                users.update(shard_users)
+        return users
+
+    def get_all_users(self, session: Session|None = None) -> list[dict[str, Any]]|None:
+        """Retrieve all the users across the shards"""
+        ring = self.ring
+        users = []
+        for shard_name in ring.nodes:
+            shard_users = self.shards[shard_name].get_all_users(session)
+            if shard_users is None:
+                logger.error(f"get_all_users failed on {shard_name}")
+                return None
+            users.extend(user for user in shard_users if ring.get_node(user['user_id']) == shard_name)
+        return users
+
+    def scan_users(self, chunk_size: int = 1000, start_after: int|None = None,
+                   keyset: bool = False) -> Iterator[list[dict[str, Any]]]:
+        """Stream the users of all the shards merged in user id order, chunk_size rows at a time"""
+        ring = self.ring
+        streams = [self._iter_rows(shard_name, ring, shard.scan_users(chunk_size, start_after, keyset))
+                   for shard_name, shard in self.shards.items() if shard_name in ring.nodes]
+        chunk = []
+        try:
+            for row in heapq.merge(*streams, key=lambda row: row['user_id']):
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            for stream in streams:
+                stream.close()
+
+    @staticmethod
+    def _iter_rows(shard_name: str, ring: ConsistentHashRing,
+                   chunks: Iterator[list[dict[str, Any]]]) -> Iterator[dict[str, Any]]:
+        # skip rows a rebalance has copied to a shard which does not own them yet, or not any more
+        try:
+            for rows in chunks:
+                for row in rows:
+                    if ring.get_node(row['user_id']) == shard_name:
+                        yield row
+        finally:
+            chunks.close()
+
+    def get_user_count(self, session: Session|None = None) -> tuple[int|None, bool]:
+        """Fetch the number of users across the shards, rows a rebalance has not cleaned up yet are counted twice"""
+        total = 0
+        for shard_name in self.ring.nodes:
+            count, success = self.shards[shard_name].get_user_count(session)
+            if not success:
+                logger.error(f"count fetch failed on {shard_name}")
+                return (None, False)
+            total += count
+        return (total, True)
+
+    def clear_users(self) -> bool:
+        """Delete all the users on every shard"""
+        success = all([shard.clear_users() for shard in self.shards.values()])
+        if self.global_index is not None:
+            success = self.global_index.clear() and success
+        return success
+
+    def cache_stats(self) -> dict[str, Any]|None:
+        """Cache counters summed over the shards, None when caching is off"""
+        shard_stats = [stats for stats in (shard.cache_stats() for shard in self.shards.values()) if stats is not None]
+        if not shard_stats:
+            return None
+        totals = {key: sum(stats[key] for stats in shard_stats) for key in ('entries', 'hits', 'misses', 'evictions')}
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_ratio'] = totals['hits'] / lookups if lookups > 0 else 0
+        return totals
+
+    def close_connection(self):
+        """Close the connection to every shard"""
+        for shard in self.shards.values():
+            shard.close_connection()
+        if self.global_index is not None:
+            self.global_index.close_connection()
+
+
+if __name__ == '__main__':
+    logger.info("Start testing Sharded database")
+    db = ShardedDatabase()
+    users = [(i, f"test{i:03d}", f"test{i:03d}@example.com") for i in range(1, 21)]
+    if db.insert_batch_users(users):
+        logger.info("users inserted")
+    else:
+        logger.error("bulk insertion failed")
+
+    for user_id in (1, 10, 20):
+        shard = db.ring.get_node(user_id)
+        logger.info(f"user {user_id} lives on {shard}: {db.get_user(user_id)}")
+
+    count, success = db.get_user_count()
+    if success:
+        logger.info(f"no of users across the shards is {count}")
+    else:
+        logger.error("user count query failed")
+
+    db.close_connection()
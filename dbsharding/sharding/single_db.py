@@ -1,134 +1,561 @@
 import logging
+import os
+import tempfile
+import time
 import yaml
 import mysql.connector
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator
+from sharding.cache import MISSING, UserCache
+from sharding.batch import PartitionResult, chunk_users, write_partitions
+from sharding.instrumentation import Instrumentation, QueryEvent
+from sharding.pool import ConnectionPool
+from sharding.replicas import ReplicaSet, Session
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SECONDARY_INDEXES = {
+    'idx_username': 'username',
+    'idx_email': 'email',
+}
+
 class SingleDatabase:
     """Single database implementation for sharding benchmark"""
 
-    def __init__(self, config_path: str = "../config/sharding-config.yaml"):
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
+    def __init__(self, config_path: str = "../config/sharding-config.yaml", db_config: dict[str, Any]|None = None,
+                 instrumentation: Instrumentation|None = None):
+        if db_config is None:
+            with open(config_path, 'r') as f:
+                config = yaml.safe_load(f)
+            db_config = config['single-db']
+
+        self.name = db_config.get('name', 'single-db')
+        self.pool = ConnectionPool.from_config(db_config)
+        self.pool.release(self.pool.acquire())
+        self.cache = UserCache.from_config(db_config)
+        self.replicas = ReplicaSet.from_config(db_config)
+        self.instrumentation = instrumentation or Instrumentation.from_config(db_config)
+
+        logger.info(f"connection pool of size {self.pool.size} created for database {self.name}")
+
+    def session(self) -> Session:
+        """Start a read-your-writes session, pass it to the reads and writes that must see each other"""
+        return Session()
+
+    def _track(self, operation: str, pool: ConnectionPool, statement: str|None = None):
+        """Instrument one call, replica calls are reported under the database name and the replica name"""
+        shard = self.name if pool is self.pool else f"{self.name}/{pool.name}"
+        return self.instrumentation.track(operation, shard, statement)
 
-        db_config = config['single-db']
-        self.connection = mysql.connector.connect(
-            host = db_config['host'],
-            port = db_config['port'],
-            user = db_config['user'],
-            password = db_config['password'],
-            database = db_config['database'],
-            auth_plugin = db_config['auth']
-        )
+    def _read_pool(self, session: Session|None = None) -> tuple[ConnectionPool, float|None]:
+        """Pool to read from, a replica when one is within the lag threshold and fresh enough for the session.
 
-        logger.info("connected to single database")
+        Also returns the time up to which the replica is known to have applied the primary's writes,
+        None when reading from the primary.
+        """
+        if self.replicas is not None:
+            replica = self.replicas.choose(session)
+            if replica is not None:
+                return replica.pool, replica.fresh_as_of()
+        return self.pool, None
 
-    def insert_user(self, user_id: int, username: str, email: str) -> bool:
+    def insert_user(self, user_id: int, username: str, email: str, session: Session|None = None) -> bool:
         """Insert a single user. Returns True on success, False on failure."""
-        cursor = None
         try:
-            cursor = self.connection.cursor()
-            query = """
-                insert into users(user_id, username, email)
-                values(%s, %s, %s)
-            """
-            cursor.execute(query, (user_id, username, email))
-            self.connection.commit()
-            return True
-        except self.connection.IntegrityError as e:
-            logger.error(f"Integrity error while inserting user {user_id}: {e}")       
-            self.connection.rollback()
+            with self._track('insert_user', self.pool) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    query = """
+                        insert into users(user_id, username, email)
+                        values(%s, %s, %s)
+                    """
+                    event.statement = query
+                    cursor.execute(query, (user_id, username, email))
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except mysql.connector.IntegrityError as e:
+            logger.error(f"Integrity error while inserting user {user_id}: {e}")
             return False
-        except self.connection.DatabaseError as e:
+        except mysql.connector.Error as e:
             logger.error(f"Database error while inserting user {user_id}: {e}")
-            self.connection.rollback()
             return False
-        finally:
-            if cursor is not None:
-                cursor.close()
-
-    def insert_batch_users(self, users: list[tuple[int, str, str]]) -> bool:
-        """Insert a multiple users"""
-        cursor = None
+        if self.cache is not None:
+            self.cache.invalidate([user_id])
+        if session is not None:
+            session.record_write()
+        return True
 
+    def insert_batch_users(self, users: list[tuple[int, str, str]], ignore_duplicates: bool = False,
+                           session: Session|None = None) -> bool:
+        """Insert a multiple users, with ignore_duplicates users which already exist are skipped"""
         try:
-            cursor = self.connection.cursor()
-            query = """
-                insert into users(user_id, username, email)
-                values(%s, %s, %s)
-            """
-            cursor.executemany(query, users)
-            self.connection.commit()
-            return True
-        except self.connection.DatabaseError as e:
+            with self._track('insert_batch_users', self.pool) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    query = f"""
+                        insert {'ignore ' if ignore_duplicates else ''}into users(user_id, username, email)
+                        values(%s, %s, %s)
+                    """
+                    event.statement = query
+                    cursor.executemany(query, users)
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
             logger.error(f"insert failed with error {e}")
-            self.connection.rollback()
             return False
-        
-        finally:
-            if cursor is not None:
-                cursor.close()
+        if self.cache is not None:
+            self.cache.invalidate([user[0] for user in users])
+        if session is not None:
+            session.record_write()
+        return True
 
-    def get_user(self, user_id: int) -> dict[str, Any]|None:
-        """Retrieve a user by User ID"""
-        cursor = None
+    def insert_batch_users_parallel(self, users: list[tuple[int, str, str]], partition_size: int = 1000,
+                                    max_workers: int|None = None, session: Session|None = None) -> list[PartitionResult]:
+        """Insert multiple users as partitions written concurrently over the pool, one result per partition"""
+        partitions = [(self.name, chunk) for chunk in chunk_users(users, partition_size)]
+        writer = lambda chunk: self.insert_batch_users(chunk, session=session)
+        return write_partitions(partitions, {self.name: writer}, max_workers or self.pool.size)
 
+    def copy_users(self, users: list[dict[str, Any]]) -> bool:
+        """Copy user rows read from another database, keeping created_at and skipping users which already exist"""
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            query = "select * from users where user_id = %s"
-            cursor.execute(query, (user_id,))
-            user = cursor.fetchone()
+            with self._track('copy_users', self.pool) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    query = """
+                        insert ignore into users(user_id, username, email, created_at)
+                        values(%s, %s, %s, %s)
+                    """
+                    event.statement = query
+                    cursor.executemany(query, [(u['user_id'], u['username'], u['email'], u['created_at']) for u in users])
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"copy of {len(users)} users failed with error {e}")
+            return False
+        if self.cache is not None:
+            self.cache.invalidate([u['user_id'] for u in users])
+        return True
+
+    def delete_users(self, user_ids: list[int]) -> bool:
+        """Delete users by User ID"""
+        if not user_ids:
+            return True
+        try:
+            with self._track('delete_users', self.pool) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    placeholders = ", ".join(["%s"] * len(user_ids))
+                    query = f"delete from users where user_id in ({placeholders})"
+                    event.statement = query
+                    cursor.execute(query, tuple(user_ids))
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"delete of {len(user_ids)} users failed with error {e}")
+            return False
+        if self.cache is not None:
+            self.cache.invalidate(user_ids)
+        return True
+
+    def get_user(self, user_id: int, session: Session|None = None) -> dict[str, Any]|None:
+        """Retrieve a user by User ID, through the cache when one is configured"""
+        if self.cache is None:
+            user, _ = self._get_user(user_id, self._read_pool(session)[0])
             return user
-        except self.connection.DatabaseError as e:
+
+        user = self.cache.get(user_id)
+        if user is not MISSING:
+            return user
+        generation = self.cache.generation()
+        pool, fresh_as_of = self._read_pool(session)
+        user, success = self._get_user(user_id, pool)
+        if success:
+            self.cache.put(user_id, user, generation, fresh_as_of)
+        return user
+
+    def _get_user(self, user_id: int, pool: ConnectionPool) -> tuple[dict[str, Any]|None, bool]:
+        try:
+            with self._track('get_user', pool) as event, pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    query = "select * from users where user_id = %s"
+                    event.statement = query
+                    cursor.execute(query, (user_id,))
+                    user = cursor.fetchone()
+                    event.rows = 1 if user is not None else 0
+                    return (user, True)
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
             logger.error(f"get_user failed for user id {user_id} with error: {e}")
+            return (None, False)
+
+    def get_user_by_username(self, username: str, session: Session|None = None) -> dict[str, Any]|None:
+        """Retrieve a user by username"""
+        return self._get_user_by('username', username, session)
+
+    def get_user_by_email(self, email: str, session: Session|None = None) -> dict[str, Any]|None:
+        """Retrieve a user by email"""
+        return self._get_user_by('email', email, session)
+
+    def _get_user_by(self, attribute: str, value: str, session: Session|None = None) -> dict[str, Any]|None:
+        if attribute not in SECONDARY_INDEXES.values():
+            raise ValueError(f"{attribute} is not indexed")
+        pool, _ = self._read_pool(session)
+        try:
+            with self._track(f"get_user_by_{attribute}", pool) as event, pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    query = f"select * from users where {attribute} = %s limit 1"
+                    event.statement = query
+                    cursor.execute(query, (value,))
+                    user = cursor.fetchone()
+                    event.rows = 1 if user is not None else 0
+                    return user
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"get user by {attribute} failed with error: {e}")
             return None
-        finally:
-            if cursor is not None:
-                cursor.close()
 
-    def get_all_users(self) -> list[dict[str, Any]]|None:
+    def get_users(self, user_ids: list[int], chunk_size: int = 500, max_workers: int|None = None,
+                  session: Session|None = None) -> dict[int, dict[str, Any]|None]|None:
+        """Retrieve many users with chunked `in (...)` queries run concurrently.
+
+        Returns a dict keyed by every requested user id, missing users map to None.
+        Returns None if any chunk fails.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        chunks = [user_ids[i:i+chunk_size] for i in range(0, len(user_ids), chunk_size)]
+        users: dict[int, dict[str, Any]|None] = dict.fromkeys(user_ids)
+        if not chunks:
+            return users
+
+        pool, _ = self._read_pool(session)
+        with ThreadPoolExecutor(max_workers=min(len(chunks), max_workers or pool.size)) as executor:
+            for rows in executor.map(lambda chunk: self._get_users_chunk(chunk, pool), chunks):
+                if rows is None:
+                    return None
+                for row in rows:
+                    users[row['user_id']] = row
+        return users
+
+    def _get_users_chunk(self, user_ids: list[int], pool: ConnectionPool) -> list[dict[str, Any]]|None:
+        try:
+            with self._track('get_users', pool) as event, pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    placeholders = ", ".join(["%s"] * len(user_ids))
+                    query = f"select * from users where user_id in ({placeholders})"
+                    event.statement = query
+                    cursor.execute(query, tuple(user_ids))
+                    rows = cursor.fetchall()
+                    event.rows = len(rows)
+                    return rows
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"get_users failed for {len(user_ids)} user ids with error: {e}")
+            return None
+
+    def get_all_users(self, session: Session|None = None) -> list[dict[str, Any]]|None:
         """Retrieve all the users in the database"""
-        cursor = None
-        users = None
+        pool, _ = self._read_pool(session)
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            query = """select * from users"""
-            cursor.execute(query)
-            users = cursor.fetchall()
-            
-            return users
-        except self.connection.DatabaseError as e:
+            with self._track('get_all_users', pool) as event, pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    query = """select * from users"""
+                    event.statement = query
+                    cursor.execute(query)
+                    users = cursor.fetchall()
+                    event.rows = len(users)
+                    return users
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
             logger.error(f"query failed with error :{e}")
             return None
+
+    def scan_users(self, chunk_size: int = 1000, start_after: int|None = None,
+                   keyset: bool = False) -> Iterator[list[dict[str, Any]]]:
+        """Stream the users in user id order, chunk_size rows at a time.
+
+        By default the rows come from one unbuffered cursor, so only the current chunk is in memory.
+        With keyset=True every chunk is its own query resuming after the last user id seen, which
+        holds no cursor between chunks. Either way a failed scan can be resumed by passing the last
+        user id it yielded as start_after.
+        """
+        if keyset:
+            yield from self._scan_users_keyset(chunk_size, start_after)
+            return
+
+        conn = self.pool.acquire()
+        cursor = None
+        exhausted = False
+        try:
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            if start_after is None:
+                query, params = "select * from users order by user_id", ()
+            else:
+                query, params = "select * from users where user_id > %s order by user_id", (start_after,)
+            # the scan counts once under scan_users, the chunks fetched from the open cursor under scan_users_fetch
+            with self._track('scan_users', self.pool, query):
+                cursor.execute(query, params)
+            while True:
+                with self._track('scan_users_fetch', self.pool, query) as event:
+                    rows = cursor.fetchmany(chunk_size)
+                    event.rows = len(rows)
+                if not rows:
+                    exhausted = True
+                    break
+                yield rows
+        except mysql.connector.Error as e:
+            logger.error(f"scan failed with error : {e}")
+            raise
         finally:
-            if cursor is not None:
+            # an abandoned unbuffered scan leaves unread rows on the connection, drop it rather than drain it
+            if exhausted and cursor is not None:
                 cursor.close()
-            
+            self.pool.release(conn, broken=not exhausted)
+
+    def _scan_users_keyset(self, chunk_size: int, start_after: int|None) -> Iterator[list[dict[str, Any]]]:
+        last_user_id = start_after
+        while True:
+            try:
+                with self._track('scan_users', self.pool) as event, self.pool.connection() as conn:
+                    cursor = conn.cursor(dictionary=True)
+                    try:
+                        if last_user_id is None:
+                            query = "select * from users order by user_id limit %s"
+                            event.statement = query
+                            cursor.execute(query, (chunk_size,))
+                        else:
+                            query = "select * from users where user_id > %s order by user_id limit %s"
+                            event.statement = query
+                            cursor.execute(query, (last_user_id, chunk_size))
+                        rows = cursor.fetchall()
+                        event.rows = len(rows)
+                    finally:
+                        cursor.close()
+            except mysql.connector.Error as e:
+                logger.error(f"keyset scan after user id {last_user_id} failed with error : {e}")
+                raise
+            if not rows:
+                return
+            yield rows
+            last_user_id = rows[-1]['user_id']
 
-    def get_user_count(self) -> tuple[int|None, bool]:
+    def get_user_count(self, session: Session|None = None) -> tuple[int|None, bool]:
         """Fetch the number of users in the database"""
-        cursor = None
-        count = None
+        pool, _ = self._read_pool(session)
         try:
-            cursor = self.connection.cursor()
-            query = "select count(*) from users"
-            cursor.execute(query)
-            count = cursor.fetchone()[0]
-            return (count, True)
-        except self.connection.DatabaseError as e:
+            with self._track('get_user_count', pool) as event, pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    query = "select count(*) from users"
+                    event.statement = query
+                    cursor.execute(query)
+                    count = cursor.fetchone()[0]
+                    event.rows = 1
+                    return (count, True)
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
             logger.error(f"count fetch failed with error : {e}")
             return (None, False)
+
+    def bulk_load_users(self, batches: Iterable[list[tuple[int, str, str]]], method: str = 'values',
+                        defer_indexes: bool = False, infile_rows: int = 100000) -> dict[str, Any]:
+        """Bulk ingest users for an initial load and report rows per second.
+
+        method='values' sends multi-row insert statements sized to the server's max_allowed_packet.
+        method='infile' writes the rows to a temporary tab separated buffer and streams it with
+        load data local infile, which needs local-infile enabled in the config and on the server.
+        defer_indexes drops the secondary indexes for the load and rebuilds them once at the end,
+        so only use it when nothing else is writing to the table.
+        """
+        if method not in ('values', 'infile'):
+            raise ValueError(f"unknown bulk load method {method}")
+
+        report = {'method': method, 'defer_indexes': defer_indexes, 'rows': 0, 'statements': 0,
+                  'load_time': 0.0, 'index_rebuild_time': 0.0, 'success': False}
+        try:
+            conn = self.pool.acquire()
+        except mysql.connector.Error as e:
+            logger.error(f"bulk load could not get a connection: {e}")
+        else:
+            restored = False
+            try:
+                restored = self._bulk_load(conn, batches, method, defer_indexes, infile_rows, report)
+            except mysql.connector.Error as e:
+                logger.error(f"bulk load failed after {report['rows']} rows with error {e}")
+            finally:
+                # unique checks may still be off on a connection which could not restore its session
+                self.pool.release(conn, broken=not restored)
+
+        if self.cache is not None:
+            self.cache.clear()
+        total_time = report['load_time'] + report['index_rebuild_time']
+        report['rows_per_second'] = report['rows'] / total_time if total_time > 0 else 0
+        self.instrumentation.record(QueryEvent(f"bulk_load_users_{method}", self.name, rows=report['rows'],
+                                               latency=total_time, success=report['success']))
+        logger.info(f"bulk loaded {report['rows']} users with {method} in {total_time:.2f} seconds")
+        return report
+
+    def _bulk_load(self, conn, batches: Iterable[list[tuple[int, str, str]]], method: str, defer_indexes: bool,
+                   infile_rows: int, report: dict[str, Any]) -> bool:
+        """Run the load on conn, returns whether the session settings were restored afterwards"""
+        cursor = conn.cursor()
+        indexes_dropped = False
+        restored = False
+        try:
+            try:
+                cursor.execute("set session unique_checks = 0")
+                if defer_indexes:
+                    drops = ", ".join(f"drop index {index}" for index in SECONDARY_INDEXES)
+                    cursor.execute(f"alter table users {drops}")
+                    indexes_dropped = True
+
+                start_time = time.perf_counter()
+                if method == 'values':
+                    self._bulk_load_values(conn, cursor, batches, report)
+                else:
+                    self._bulk_load_infile(conn, cursor, batches, infile_rows, report)
+                report['load_time'] = time.perf_counter() - start_time
+                report['success'] = True
+            except mysql.connector.Error as e:
+                logger.error(f"bulk load failed after {report['rows']} rows with error {e}")
+                try:
+                    conn.rollback()
+                except mysql.connector.Error as rollback_error:
+                    logger.error(f"rollback of the failed bulk load failed with error {rollback_error}")
         finally:
-            if cursor is not None:
+            # a failed rebuild is logged rather than raised, so it never hides why the load failed
+            if indexes_dropped:
+                try:
+                    start_time = time.perf_counter()
+                    adds = ", ".join(f"add index {index} ({column})" for index, column in SECONDARY_INDEXES.items())
+                    cursor.execute(f"alter table users {adds}")
+                    report['index_rebuild_time'] = time.perf_counter() - start_time
+                except mysql.connector.Error as e:
+                    report['success'] = False
+                    logger.error(f"rebuilding indexes {', '.join(SECONDARY_INDEXES)} after the bulk load failed with "
+                                 f"error {e}, they have to be added back by hand")
+            try:
+                cursor.execute("set session unique_checks = 1")
+                restored = True
+            except mysql.connector.Error as e:
+                logger.error(f"restoring unique checks after the bulk load failed with error {e}")
+            try:
                 cursor.close()
+            except mysql.connector.Error:
+                pass
+        return restored
+
+    def _bulk_load_values(self, conn, cursor, batches: Iterable[list[tuple[int, str, str]]], report: dict[str, Any]):
+        cursor.execute("select @@max_allowed_packet")
+        statement_limit = int(cursor.fetchone()[0] * 0.9)
+        prefix = "insert into users(user_id, username, email) values "
+        rows: list[tuple[int, str, str]] = []
+        size = len(prefix)
+
+        def flush():
+            query = prefix + ", ".join(["(%s, %s, %s)"] * len(rows))
+            cursor.execute(query, [value for row in rows for value in row])
+            conn.commit()
+            report['rows'] += len(rows)
+            report['statements'] += 1
+
+        for batch in batches:
+            for row in batch:
+                # quoted, escaped values plus the separators, escaping can at most double the strings.
+                # the packet limit is in bytes, so measure the encoded strings, not their characters
+                row_size = len(str(row[0])) + 2 * (len(row[1].encode('utf-8')) + len(row[2].encode('utf-8'))) + 12
+                if rows and size + row_size > statement_limit:
+                    flush()
+                    rows, size = [], len(prefix)
+                rows.append(row)
+                size += row_size
+        if rows:
+            flush()
+
+    def _bulk_load_infile(self, conn, cursor, batches: Iterable[list[tuple[int, str, str]]], infile_rows: int,
+                          report: dict[str, Any]):
+        def escape(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+        def load(path: str, rows: int):
+            query = f"""
+                load data local infile '{path}' into table users
+                fields terminated by '\\t' lines terminated by '\\n'
+                (user_id, username, email)
+            """
+            cursor.execute(query)
+            conn.commit()
+            report['rows'] += rows
+            report['statements'] += 1
+
+        fd, path = tempfile.mkstemp(prefix='users-', suffix='.tsv')
+        buffer = os.fdopen(fd, 'w', encoding='utf-8', newline='\n')
+        try:
+            rows = 0
+            for batch in batches:
+                for user_id, username, email in batch:
+                    buffer.write(f"{user_id}\t{escape(username)}\t{escape(email)}\n")
+                    rows += 1
+                if rows >= infile_rows:
+                    buffer.close()
+                    load(path, rows)
+                    buffer = open(path, 'w', encoding='utf-8', newline='\n')
+                    rows = 0
+            buffer.close()
+            if rows:
+                load(path, rows)
+        finally:
+            buffer.close()
+            os.remove(path)
+
+    def clear_users(self) -> bool:
+        """Delete all the users in the database"""
+        try:
+            with self._track('clear_users', self.pool) as event, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    query = "delete from users"
+                    event.statement = query
+                    cursor.execute(query)
+                    event.rows = cursor.rowcount
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.error(f"clear users failed with {e}")
+            return False
+        if self.cache is not None:
+            self.cache.clear()
+        return True
+
+    def cache_stats(self) -> dict[str, Any]|None:
+        """Hit, miss and eviction counters of the cache, None when caching is off"""
+        return self.cache.stats() if self.cache is not None else None
 
     def close_connection(self):
-        """Close the database connection"""
-        if self.connection.is_connected():
-            self.connection.close()
-            logger.info("database connection closed")
+        """Close the pooled database connections"""
+        self.pool.close()
+        if self.replicas is not None:
+            self.replicas.close()
+        logger.info(f"database connections closed for {self.name}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+import mysql.connector
+from sharding.replicas import Replica, ReplicaSet, Session
+from sharding.single_db import SingleDatabase
+
+class StandInPool:
+    """Hands out the replica name as the connection, so the lag probe knows which replica it measures"""
+
+    def __init__(self, name: str, reachable: bool = True):
+        self.name = name
+        self.reachable = reachable
+
+    @contextmanager
+    def connection(self):
+        if not self.reachable:
+            raise mysql.connector.InterfaceError("replica unreachable")
+        yield self.name
+
+    def close(self):
+        pass
+
+
+def replica_set(lags: dict[str, float|None], max_lag: float = 5, check_interval: float = 0) -> ReplicaSet:
+    replicas = [Replica(name, StandInPool(name)) for name in lags]
+    return ReplicaSet(replicas, max_lag, check_interval, lag_probe=lambda conn: lags[conn])
+
+
+def chosen(replicas: ReplicaSet, times: int, session: Session|None = None) -> list[str|None]:
+    return [getattr(replicas.choose(session), 'name', None) for _ in range(times)]
+
+
+def test_round_robin_over_replicas_within_lag():
+    replicas = replica_set({'replica-1': 1, 'replica-2': 2})
+    assert chosen(replicas, 4) == ['replica-1', 'replica-2', 'replica-1', 'replica-2']
+
+
+def test_lagging_replica_is_skipped():
+    replicas = replica_set({'replica-1': 1, 'replica-2': 30})
+    assert set(chosen(replicas, 4)) == {'replica-1'}
+
+
+def test_replica_is_used_again_once_it_catches_up():
+    lags = {'replica-1': 1, 'replica-2': 30}
+    replicas = replica_set(lags)
+    assert set(chosen(replicas, 2)) == {'replica-1'}
+    lags['replica-2'] = 1
+    assert set(chosen(replicas, 2)) == {'replica-1', 'replica-2'}
+
+
+def test_stopped_replication_is_skipped():
+    replicas = replica_set({'replica-1': None, 'replica-2': 1})
+    assert set(chosen(replicas, 2)) == {'replica-2'}
+
+
+def test_unreachable_replica_is_skipped():
+    replicas = replica_set({'replica-1': 1, 'replica-2': 1})
+    replicas.replicas[0].pool.reachable = False
+    assert set(chosen(replicas, 2)) == {'replica-2'}
+
+
+def test_no_replica_when_all_lag():
+    replicas = replica_set({'replica-1': 30, 'replica-2': 30})
+    assert replicas.choose() is None
+
+
+def test_lag_is_not_measured_again_within_check_interval():
+    probes = []
+    def lag_probe(conn):
+        probes.append(conn)
+        return 1
+    replicas = ReplicaSet([Replica('replica-1', StandInPool('replica-1'))], check_interval=60, lag_probe=lag_probe)
+    chosen(replicas, 5)
+    assert probes == ['replica-1']
+
+
+def test_session_without_writes_reads_from_any_replica():
+    replicas = replica_set({'replica-1': 0, 'replica-2': 4})
+    assert set(chosen(replicas, 2, Session())) == {'replica-1', 'replica-2'}
+
+
+def test_session_skips_replicas_behind_its_last_write():
+    replicas = replica_set({'replica-1': 0, 'replica-2': 4})
+    session = Session()
+    session.record_write()
+    assert set(chosen(replicas, 4, session)) == {'replica-1'}
+
+
+def test_session_falls_back_when_no_replica_has_its_write():
+    replicas = replica_set({'replica-1': 2, 'replica-2': 4})
+    session = Session()
+    session.record_write()
+    assert replicas.choose(session) is None
+    # other sessions keep reading from the replicas
+    assert replicas.choose(Session()) is not None
+
+
+def test_session_reads_its_write_from_the_primary():
+    # skip __init__, it connects to the primary
+    db = SingleDatabase.__new__(SingleDatabase)
+    db.pool = StandInPool('primary')
+    db.replicas = replica_set({'replica-1': 2})
+    session = db.session()
+    assert db._read_pool(session)[0].name == 'replica-1'
+    session.record_write()
+    assert db._read_pool(session) == (db.pool, None)
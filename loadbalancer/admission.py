@@ -0,0 +1,108 @@
+import collections
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class AdaptiveLimit:
+    """AIMD concurrency limit. The limit grows by about one per limit's worth of fast responses, and is cut by
+    `backoff` when a response fails or takes more than tolerance x the baseline latency. The baseline is the
+    lowest latency seen over the last one to two baseline_window periods"""
+    def __init__(self, initial=20, min_limit=1, max_limit=1000, tolerance=2.0, backoff=0.9, baseline_window=30.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baseline_window = baseline_window
+        self.window_min = None
+        self.previous_min = None
+        self.window_started = time.monotonic()
+        self.decreased_at = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, latency, ok):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_started > self.baseline_window:
+                self.previous_min, self.window_min = self.window_min, None
+                self.window_started = now
+            if ok and (self.window_min is None or latency < self.window_min):
+                self.window_min = latency
+            baseline = min(m for m in (self.window_min, self.previous_min, latency) if m is not None)
+            if not ok or latency > baseline * self.tolerance:
+                # one cut per round trip, or a burst of slow responses would collapse the limit at once
+                if now - self.decreased_at > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.decreased_at = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def value(self):
+        return int(self.limit)
+
+class Admission:
+    """decides up front whether a request may go in, so overload is turned away fast instead of queueing.
+    rate limits answer 429, in-flight and adaptive concurrency limits 503. A limit of 0 is off"""
+    def __init__(self, rate=0, burst=0, client_rate=0, client_burst=0, max_in_flight=0, adaptive=None, max_clients=10000):
+        # a bucket must hold at least one token, or a rate under 1/s would never admit anything
+        self.bucket = TokenBucket(rate, max(1, burst or rate)) if rate else None
+        self.client_rate = client_rate
+        self.client_burst = max(1, client_burst or client_rate)
+        self.client_buckets = collections.OrderedDict()
+        self.max_clients = max_clients
+        self.max_in_flight = max_in_flight
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def limit(self):
+        limits = [self.max_in_flight] if self.max_in_flight else []
+        if self.adaptive is not None:
+            limits.append(self.adaptive.value())
+        return min(limits) if limits else None
+
+    def admit(self, client):
+        """None if the request is admitted, otherwise (status, reason). An admitted request must be released"""
+        if self.bucket is not None and not self.bucket.try_acquire():
+            return 429, "rate"
+        if self.client_rate and client is not None and not self.client_bucket(client).try_acquire():
+            return 429, "client_rate"
+        limit = self.limit()
+        with self.lock:
+            if limit is not None and self.in_flight >= limit:
+                return 503, "concurrency"
+            self.in_flight += 1
+        return None
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def client_bucket(self, client):
+        with self.lock:
+            bucket = self.client_buckets.get(client)
+            if bucket is None:
+                bucket = self.client_buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+                if len(self.client_buckets) > self.max_clients:
+                    # forget the least recently seen client, it starts again with a full bucket
+                    self.client_buckets.popitem(last=False)
+            else:
+                self.client_buckets.move_to_end(client)
+            return bucket
@@ -0,0 +1,346 @@
+from aiohttp import web
+import aiohttp
+import asyncio
+import logging
+import random
+import time
+import types
+
+from load_balancer import (LoadBalancer, PORT, BACKENDS, HEALTH_INTERVAL, MAX_CONNECTIONS, IDLE_TIMEOUT, POOL_TIMEOUT,
+                           STREAMING, CHUNK_SIZE, HEALTH_TIMEOUT, HEALTH_JITTER, BALANCING, BACKEND_WEIGHTS, HASH_LOAD_FACTOR,
+                           CACHE_BYTES, CACHE_MAX_ENTRY_BYTES, TRY_TIMEOUT, RETRIES, HEDGING,
+                           ProxyError, strip_hop_by_hop, routing_key, client_key, cache_headers)
+from retries import IDEMPOTENT_METHODS, RETRY_STATUSES
+from cache import CacheEntry, AsyncCoalescer, request_is_cacheable, freshness
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RequestStream:
+    """streams the client body upstream, counting what was sent"""
+    def __init__(self, content):
+        self.content = content
+        self.sent = 0
+
+    async def __aiter__(self):
+        async for chunk in self.content.iter_chunked(CHUNK_SIZE):
+            self.sent += len(chunk)
+            yield chunk
+
+def usable(upstream):
+    return upstream is not None and upstream.status not in RETRY_STATUSES
+
+def outcome(task):
+    """the upstream of a hedged attempt, None if it failed, raised or was cancelled"""
+    return None if task.cancelled() or task.exception() is not None else task.result()
+
+async def queued_start(session, context, params):
+    context.trace_request_ctx.queued = True
+
+async def queued_end(session, context, params):
+    context.trace_request_ctx.queued = False
+
+class AsyncProxy:
+    """asyncio proxy engine over the same LoadBalancer and Backend objects as the flask app"""
+    def __init__(self, lb):
+        self.lb = lb
+        self.session = None
+        self.health_tasks = []
+        self.coalescer = AsyncCoalescer()
+        # per try: getting a connection, from the pool or a new one, then connecting, and then each read,
+        # including waiting for the response headers
+        self.try_timeout = aiohttp.ClientTimeout(total=None, connect=POOL_TIMEOUT, sock_connect=TRY_TIMEOUT,
+                                                 sock_read=TRY_TIMEOUT)
+        self.background = set()
+
+    async def start(self, app):
+        # one keep-alive pool shared by all backends, capped per backend like the flask engine
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=MAX_CONNECTIONS, keepalive_timeout=IDLE_TIMEOUT)
+        # tells a try that timed out waiting for a free connection apart from a backend that failed
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(queued_start)
+        trace.on_connection_queued_end.append(queued_end)
+        self.session = aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                             cookie_jar=aiohttp.DummyCookieJar(), trace_configs=[trace])
+        logger.info("health check loop started")
+        self.health_tasks = [asyncio.create_task(self.health_check_loop(backend)) for backend in self.lb.backends]
+
+    async def stop(self, app):
+        for task in self.health_tasks:
+            task.cancel()
+        await self.session.close()
+
+    async def check_health(self, backend):
+        try:
+            async with self.session.get(f"{backend.url}/health", timeout=aiohttp.ClientTimeout(total=HEALTH_TIMEOUT)) as resp:
+                ok = resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        self.lb.record_check(backend, ok)
+
+    async def health_check_loop(self, backend):
+        await asyncio.sleep(random.uniform(0, self.lb.health_check_interval))
+        while True:
+            await self.check_health(backend)
+            await asyncio.sleep(backend.health.next_check_in(self.lb.health_check_interval, HEALTH_JITTER))
+
+    async def proxy(self, request):
+        rejection = self.lb.admission.admit(client_key(request.remote, request.headers, request.cookies))
+        if rejection is not None:
+            status, reason = rejection
+            self.lb.metrics.inc("rejected", None, reason)
+            return web.Response(text=f"{reason} limit exceeded", status=status, headers={"Retry-After": "1"})
+        try:
+            if self.lb.cache is not None and request_is_cacheable(request.method, request.headers):
+                return await self.cached_proxy(request)
+            return await self.forward(request)
+        finally:
+            self.lb.admission.release()
+
+    async def send(self, backend, method, path, headers, body=None):
+        """the upstream response with its body unread, or None if the backend could not be reached.
+        the caller releases it and ends the backend request. Raises ProxyError(503) when the backend is at
+        MAX_BACKEND_IN_FLIGHT or every connection to it stays busy for POOL_TIMEOUT"""
+        if not backend.start_request():
+            # another request took the backend's last slot after it was picked
+            raise self.lb.backend_limit_reached()
+        start = time.perf_counter()
+        waiting = types.SimpleNamespace(queued=False)
+        try:
+            upstream = await self.session.request(method, f"{backend.url}{path}", headers=headers, data=body,
+                                                  allow_redirects=False, timeout=self.try_timeout,
+                                                  trace_request_ctx=waiting)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            backend.end_request()
+            if waiting.queued:
+                # the proxy is out of connections, not the backend failing, so it is not held against its health
+                self.lb.metrics.inc("pool_timeouts", backend.url)
+                logger.warning(f"no free connection to {backend.url} within {POOL_TIMEOUT}s")
+                raise ProxyError(503, "no free connection to the backend")
+            self.lb.record_response(backend, None, time.perf_counter() - start)
+            logger.error(f"Backend {backend.url} failed: {e}")
+            return None
+        self.lb.record_response(backend, upstream.status, time.perf_counter() - start)
+        return upstream
+
+    def discard(self, upstream, backend):
+        upstream.release()
+        backend.end_request()
+
+    def discard_when_done(self, task, backend):
+        if outcome(task) is not None:
+            self.discard(outcome(task), backend)
+
+    async def hedge(self, first, tried, hash_key, method, path, headers, body):
+        """sends to first, and to a second backend as well if first has not answered within the hedge delay.
+        returns (backend, upstream) for the first usable response. The other one is discarded when it arrives"""
+        attempts = {asyncio.create_task(self.send(first, method, path, headers, body)): first}
+        done, _ = await asyncio.wait(attempts, timeout=self.lb.hedge_delay())
+        if not done:
+            second = self.lb.get_next_backend(hash_key, exclude=tried)
+            if second is not None and self.lb.retry_budget.withdraw():
+                tried.append(second)
+                self.lb.metrics.inc("hedges", first.url)
+                attempts[asyncio.create_task(self.send(second, method, path, headers, body))] = second
+        pending = set(attempts)
+        winner = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # a usable response wins over an unusable one that finished in the same batch
+            for task in sorted(done, key=lambda t: not usable(outcome(t))):
+                if winner is None and (usable(outcome(task)) or not pending):
+                    winner = task
+                else:
+                    self.discard_when_done(task, attempts[task])
+            if winner is not None:
+                break
+        for task in pending:
+            task.add_done_callback(lambda t, backend=attempts[task]: self.discard_when_done(t, backend))
+        return attempts[winner], winner.result()
+
+    async def dispatch(self, method, path, headers, body, hash_key):
+        """sends the request, retrying idempotent ones on other backends within the retry budget.
+        returns (backend, upstream) with the body unread, or raises ProxyError. When no retry can follow,
+        the backend's own error response is returned rather than a generated one"""
+        # a streamed body is gone after the first try, so only buffered or empty bodies can be sent again
+        replayable = method in IDEMPOTENT_METHODS and (body is None or isinstance(body, bytes))
+        tries = 1 + RETRIES if replayable else 1
+        tried = []
+        last = None
+        self.lb.retry_budget.record_request()
+        try:
+            for attempt in range(tries):
+                backend = self.lb.get_next_backend(hash_key, exclude=tried)
+                if backend is None:
+                    break
+                if attempt > 0:
+                    if not self.lb.retry_budget.withdraw():
+                        break
+                    self.lb.metrics.inc("retries", tried[-1].url)
+                tried.append(backend)
+                if replayable and HEDGING and self.lb.hedge_delay() is not None:
+                    backend, upstream = await self.hedge(backend, tried, hash_key, method, path, headers, body)
+                else:
+                    upstream = await self.send(backend, method, path, headers, body)
+                if upstream is None:
+                    continue
+                if last is not None:
+                    self.discard(last[1], last[0])
+                last = (backend, upstream)
+                if usable(upstream):
+                    return last
+        except ProxyError:
+            if last is None:
+                raise
+        except BaseException:
+            if last is not None:
+                self.discard(last[1], last[0])
+            raise
+        if last is not None:
+            return last
+        if not tried:
+            raise self.lb.no_backend()
+        raise ProxyError(502, "backend unavailable")
+
+    async def read(self, upstream, backend, limit=None):
+        """reads the whole body, or up to limit bytes. The upstream is released once the body is done"""
+        try:
+            if limit is None:
+                content = await upstream.read()
+            else:
+                content = b""
+                while len(content) < limit and not upstream.content.at_eof():
+                    content += await upstream.content.read(limit - len(content))
+        except BaseException:
+            upstream.release()
+            backend.end_request()
+            raise
+        if limit is None or upstream.content.at_eof():
+            upstream.release()
+            backend.end_request()
+        self.lb.metrics.inc("response_bytes", backend.url, value=len(content))
+        return content
+
+    async def stream(self, request, upstream, backend, first_chunk=b""):
+        try:
+            response = web.StreamResponse(status=upstream.status, headers=strip_hop_by_hop(upstream.headers.items()))
+            await response.prepare(request)
+            if first_chunk:
+                # read() already counted the buffered prefix
+                await response.write(first_chunk)
+            async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+                self.lb.metrics.inc("response_bytes", backend.url, value=len(chunk))
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # headers already went out, all we can do is drop the connection
+            logger.error(f"Backend {backend.url} failed: {e}")
+            raise
+        finally:
+            upstream.release()
+            backend.end_request()
+
+    async def forward(self, request):
+        hash_key = routing_key(request.remote, request.headers, request.cookies)
+        headers = strip_hop_by_hop(request.headers.items(), extra=("host",))
+        if STREAMING and request.body_exists:
+            body = RequestStream(request.content)
+        elif STREAMING:
+            body = None
+        else:
+            body = await request.read()
+        try:
+            backend, upstream = await self.dispatch(request.method, str(request.rel_url), headers, body, hash_key)
+        except ProxyError as e:
+            return web.Response(text=e.message, status=e.status)
+        if isinstance(body, bytes):
+            self.lb.metrics.inc("request_bytes", backend.url, value=len(body))
+        elif body is not None:
+            self.lb.metrics.inc("request_bytes", backend.url, value=body.sent)
+        if STREAMING:
+            return await self.stream(request, upstream, backend)
+        content = await self.read(upstream, backend)
+        return web.Response(body=content, status=upstream.status,
+                            headers=strip_hop_by_hop(upstream.headers.items(), extra=("content-length",)))
+
+    async def fetch_into_cache(self, key, path, headers, hash_key):
+        """fetches a cacheable GET. Returns (entry, None) if the response was stored, otherwise (None, private)
+        where private is a ready response or the unread (upstream, backend, first_chunk) for the caller alone"""
+        try:
+            backend, upstream = await self.dispatch("GET", path, headers, None, hash_key)
+        except ProxyError as e:
+            return None, web.Response(text=e.message, status=e.status)
+        lifetime = freshness(upstream.status, upstream.headers)
+        max_entry_bytes = self.lb.cache.max_entry_bytes
+        if lifetime is None or (upstream.content_length or 0) > max_entry_bytes:
+            return None, (upstream, backend, b"")
+        content = await self.read(upstream, backend, max_entry_bytes + 1)
+        if len(content) > max_entry_bytes:
+            # no Content-Length and too big after all, send on what is read and stream the rest
+            return None, (upstream, backend, content)
+        entry = CacheEntry(upstream.status, cache_headers(strip_hop_by_hop(upstream.headers.items())), content, *lifetime)
+        if not self.lb.cache.store(key, entry):
+            return None, self.cached_response(entry)
+        return entry, None
+
+    def cached_response(self, entry):
+        return web.Response(body=entry.body, status=entry.status, headers=entry.headers + [("Age", str(entry.age()))])
+
+    async def revalidate(self, key, path, headers, hash_key):
+        _, private, _ = await self.coalescer.run(key, lambda: self.fetch_into_cache(key, path, headers, hash_key))
+        if isinstance(private, tuple):
+            # nobody is waiting for it, just release the upstream connection
+            upstream, backend, _ = private
+            upstream.release()
+            backend.end_request()
+
+    async def cached_proxy(self, request):
+        path = str(request.rel_url)
+        key = self.lb.cache.key(path, request.headers)
+        hash_key = routing_key(request.remote, request.headers, request.cookies)
+        headers = strip_hop_by_hop(request.headers.items(), extra=("host",))
+        entry, fresh = self.lb.cache.lookup(key)
+        if entry is not None:
+            if not fresh and not self.coalescer.in_flight(key):
+                # stale-while-revalidate: serve it now and refresh it in the background
+                task = asyncio.create_task(self.revalidate(key, path, headers, hash_key))
+                self.background.add(task)
+                task.add_done_callback(self.background.discard)
+            self.lb.metrics.inc("cache", None, "hit" if fresh else "stale")
+            return self.cached_response(entry)
+
+        entry, private, leader = await self.coalescer.run(key, lambda: self.fetch_into_cache(key, path, headers, hash_key))
+        self.lb.metrics.inc("cache", None, "miss" if leader else "coalesced")
+        if entry is not None:
+            return self.cached_response(entry)
+        if isinstance(private, tuple):
+            return await self.stream(request, *private)
+        if private is not None:
+            return private
+        # the response we waited for could not be shared
+        return await self.forward(request)
+
+    async def lbmetrics(self, request):
+        return web.Response(text=self.lb.metrics.render(self.lb.backends, self.lb.cache, self.lb.admission),
+                            headers={"Content-Type": "text/plain; version=0.0.4"})
+
+    async def lbstatus(self, request):
+        return web.json_response(self.lb.status())
+
+def create_app(lb):
+    engine = AsyncProxy(lb)
+    app = web.Application(client_max_size=0)
+    app.on_startup.append(engine.start)
+    app.on_cleanup.append(engine.stop)
+    app.router.add_get("/lb/status", engine.lbstatus)
+    app.router.add_get("/lb/metrics", engine.lbmetrics)
+    app.router.add_route("*", "/{path:.*}", engine.proxy)
+    return app
+
+if __name__ == '__main__':
+    logger.info(f"async load balancer starting on port {PORT} ")
+    logger.info(f"list of backends {BACKENDS}")
+    lb = LoadBalancer(BACKENDS, HEALTH_INTERVAL, BALANCING, BACKEND_WEIGHTS, HASH_LOAD_FACTOR,
+                      CACHE_BYTES, CACHE_MAX_ENTRY_BYTES)
+    web.run_app(create_app(lb), host="0.0.0.0", port=PORT, backlog=1024, access_log=None)
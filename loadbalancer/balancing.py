@@ -0,0 +1,164 @@
+import bisect
+import hashlib
+import math
+import random
+import threading
+import time
+
+class Strategy:
+    """picks one backend out of the candidates for each request. key is the request's routing key, if any.
+    available is every backend that is up, including candidates left out for this request only (already tried, or at
+    their in-flight cap), for strategies whose state should not churn with those"""
+    def choose(self, backends, key=None, available=None):
+        raise NotImplementedError
+
+class RoundRobin(Strategy):
+    def __init__(self):
+        self.current_index = 0
+        self.lock = threading.Lock()
+
+    def choose(self, backends, key=None, available=None):
+        with self.lock:
+            self.current_index = self.current_index % len(backends)
+            backend = backends[self.current_index]
+            self.current_index += 1
+            return backend
+
+class WeightedRoundRobin(Strategy):
+    """smooth weighted round robin: a weight 3 backend gets 3 of every 5 requests against two weight 1 ones, interleaved"""
+    def __init__(self):
+        self.current_weights = {}
+        self.lock = threading.Lock()
+
+    def choose(self, backends, key=None, available=None):
+        with self.lock:
+            total = 0
+            best = None
+            for backend in backends:
+                weight = self.current_weights.get(backend.url, 0) + backend.weight
+                self.current_weights[backend.url] = weight
+                total += backend.weight
+                if best is None or weight > self.current_weights[best.url]:
+                    best = backend
+            self.current_weights[best.url] -= total
+            return best
+
+class LeastOutstanding(Strategy):
+    """fewest in-flight requests, weighted by capacity, ties broken round robin"""
+    def __init__(self):
+        self.tie_breaker = RoundRobin()
+
+    def choose(self, backends, key=None, available=None):
+        lowest = min(b.in_flight / b.weight for b in backends)
+        candidates = [b for b in backends if b.in_flight / b.weight == lowest]
+        return self.tie_breaker.choose(candidates)
+
+class PowerOfTwoChoices(Strategy):
+    """two random backends, the less loaded one wins. Close to least outstanding without scanning every backend"""
+    def choose(self, backends, key=None, available=None):
+        if len(backends) == 1:
+            return backends[0]
+        first, second = random.sample(backends, 2)
+        return first if first.in_flight / first.weight <= second.in_flight / second.weight else second
+
+class PeakEWMA(Strategy):
+    """power of two choices on (peak ewma latency) * (in-flight + 1), so slow and busy backends both lose"""
+    def choose(self, backends, key=None, available=None):
+        if len(backends) == 1:
+            return backends[0]
+        first, second = random.sample(backends, 2)
+        return first if self.cost(first) <= self.cost(second) else second
+
+    def cost(self, backend):
+        return backend.latency.value() * (backend.in_flight + 1) / backend.weight
+
+class ConsistentHash(Strategy):
+    """sticky routing: a key maps to the same backend while it stays healthy and under load_factor x its fair share
+    of the in-flight requests. Otherwise the key walks on to the next backend on the ring"""
+    def __init__(self, load_factor=1.25, virtual_nodes=100):
+        self.load_factor = load_factor
+        self.virtual_nodes = virtual_nodes
+        self.fallback = RoundRobin()
+        self.ring = ((), [], [])
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def hash_key(key):
+        digest = hashlib.md5(str(key).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def ring_for(self, backends):
+        # the ring holds the available backends. A backend going down or coming back only moves its own keys,
+        # one skipped for a single request (already tried, or at its in-flight cap) does not change the ring at all
+        urls = tuple(b.url for b in backends)
+        with self.lock:
+            if self.ring[0] != urls:
+                points = sorted((self.hash_key(f"{b.url}#{i}"), index)
+                                for index, b in enumerate(backends) for i in range(self.virtual_nodes))
+                self.ring = (urls, [h for h, _ in points], [backends[index] for _, index in points])
+            return self.ring
+
+    def choose(self, backends, key=None, available=None):
+        if key is None:
+            return self.fallback.choose(backends)
+        available = available or backends
+        urls, hashes, owners = self.ring_for(available)
+        candidates = {b.url for b in backends}
+        total_in_flight = sum(b.in_flight for b in available)
+        total_weight = sum(b.weight for b in available)
+        start = bisect.bisect(hashes, self.hash_key(key))
+        seen = set()
+        first = None
+        for i in range(len(hashes)):
+            backend = owners[(start + i) % len(hashes)]
+            if backend.url in seen:
+                continue
+            seen.add(backend.url)
+            if backend.url in candidates:
+                first = first or backend
+                capacity = math.ceil(self.load_factor * (total_in_flight + 1) * backend.weight / total_weight)
+                if backend.in_flight < capacity:
+                    return backend
+            if len(seen) == len(urls):
+                break
+        # every candidate is over its share, the key's first candidate on the ring takes it anyway
+        return first or self.fallback.choose(backends)
+
+class PeakEWMALatency:
+    """moving average of latency that jumps to any higher sample and decays over decay_time seconds"""
+    def __init__(self, decay_time=10.0, initial=0.1):
+        self.decay_time = decay_time
+        self.ewma = initial
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def observe(self, latency):
+        with self.lock:
+            now = time.monotonic()
+            weight = math.exp(-(now - self.updated_at) / self.decay_time)
+            self.updated_at = now
+            if latency > self.ewma:
+                self.ewma = latency
+            else:
+                self.ewma = self.ewma * weight + latency * (1 - weight)
+
+    def value(self):
+        # decay towards zero while idle, so a backend that was slow once gets picked again and re-measured
+        with self.lock:
+            return self.ewma * math.exp(-(time.monotonic() - self.updated_at) / self.decay_time)
+
+STRATEGIES = {
+    "round-robin": RoundRobin,
+    "weighted-round-robin": WeightedRoundRobin,
+    "least-outstanding": LeastOutstanding,
+    "p2c": PowerOfTwoChoices,
+    "peak-ewma": PeakEWMA,
+    "consistent-hash": ConsistentHash
+}
+
+def create_strategy(name, hash_load_factor=1.25):
+    if name not in STRATEGIES:
+        raise ValueError(f"unknown balancing strategy {name}, choose from {', '.join(STRATEGIES)}")
+    if name == "consistent-hash":
+        return ConsistentHash(hash_load_factor)
+    return STRATEGIES[name]()
@@ -0,0 +1,204 @@
+import aiohttp
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENGINES = {"flask": "load_balancer.py", "async": "async_load_balancer.py"}
+
+def percentile(sorted_latencies, p):
+    if not sorted_latencies:
+        return 0.0
+    index = min(len(sorted_latencies) - 1, int(p / 100 * len(sorted_latencies)))
+    return sorted_latencies[index]
+
+class Recorder:
+    """latencies, errors and which backend answered, for one run"""
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = collections.Counter()
+        self.backends = collections.Counter()
+
+    async def request(self, session, url, sent_at=None):
+        # open loop passes the time the request was due, so time spent waiting for a free slot counts as latency
+        start = sent_at or time.perf_counter()
+        try:
+            async with session.get(url) as resp:
+                await resp.read()
+                self.statuses[resp.status] += 1
+                self.backends[resp.headers.get("X-Service-Id", "unknown")] += 1
+                if not 200 <= resp.status < 400:
+                    self.errors += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.statuses["error"] += 1
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - start)
+
+    def summary(self, url, elapsed, **settings):
+        latencies = sorted(self.latencies)
+        return {
+            "url": url,
+            **settings,
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed,
+            "error_rate": self.errors / len(latencies) if latencies else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "p999_ms": percentile(latencies, 99.9) * 1000,
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "backends": dict(self.backends)
+        }
+
+async def closed_loop(url, concurrency, duration):
+    """each of the concurrency clients sends its next request as soon as the last one completes"""
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            while time.perf_counter() < deadline:
+                await recorder.request(session, url)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return recorder.summary(url, elapsed, mode="closed", concurrency=concurrency)
+
+async def open_loop(url, rps, duration, max_connections=1000):
+    """requests go out at a fixed rate whether or not earlier ones have come back, like real independent users"""
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        tasks = []
+        for i in range(int(rps * duration)):
+            due = start + i / rps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(recorder.request(session, url, sent_at=due)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return recorder.summary(url, elapsed, mode="open", target_rps=rps)
+
+async def run_load(url, mode, concurrency, rps, duration):
+    if mode == "open":
+        return await open_loop(url, rps, duration)
+    return await closed_loop(url, concurrency, duration)
+
+async def compare(targets, mode, concurrency, rps, duration):
+    results = {}
+    for name, url in targets:
+        results[name] = await run_load(url, mode, concurrency, rps, duration)
+    return results
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def parse_profile(spec):
+    """delay_ms=20,jitter_ms=5,error_rate=0.01,payload_bytes=1024 -> service.py environment"""
+    names = {"delay_ms": "DELAY_MS", "jitter_ms": "DELAY_JITTER_MS", "error_rate": "ERROR_RATE",
+             "payload_bytes": "PAYLOAD_BYTES"}
+    env = {}
+    for part in filter(None, spec.split(",")):
+        name, _, value = part.partition("=")
+        if name not in names:
+            raise ValueError(f"unknown profile setting {name}, choose from {', '.join(names)}")
+        env[names[name]] = value
+    return env
+
+def spawn(script, env, log):
+    return subprocess.Popen([sys.executable, os.path.join(HERE, script)], env={**os.environ, **env},
+                            stdout=log, stderr=subprocess.STDOUT)
+
+def wait_until_ready(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def run_local(engines, backends, profiles, lb_env, mode, concurrency, rps, duration):
+    """starts `backends` stub services and each engine in front of them in turn, and loads them the same way"""
+    processes = []
+    log = open(os.devnull, "w")
+    try:
+        ports = []
+        for i in range(backends):
+            port = free_port()
+            profile = parse_profile(profiles[i % len(profiles)]) if profiles else {}
+            processes.append(spawn("service.py", {"PORT": str(port), "SERVICE_ID": f"backend-{i + 1}", **profile}, log))
+            ports.append(port)
+        for port in ports:
+            if not wait_until_ready(port):
+                raise RuntimeError(f"stub backend on port {port} did not start")
+        urls = [f"http://127.0.0.1:{port}" for port in ports]
+
+        results = {}
+        for engine in engines:
+            port = free_port()
+            lb = spawn(ENGINES[engine], {"PORT": str(port), "BACKENDS": ",".join(urls), **lb_env}, log)
+            lb_url = f"http://127.0.0.1:{port}/"
+            try:
+                if not wait_until_ready(port):
+                    raise RuntimeError(f"{engine} load balancer did not start")
+                results[engine] = asyncio.run(run_load(lb_url, mode, concurrency, rps, duration))
+                results[engine]["backend_profiles"] = profiles
+                results[engine]["lb_env"] = lb_env
+            finally:
+                lb.terminate()
+                lb.wait()
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        log.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="throughput/latency benchmark for the load balancer engines")
+    parser.add_argument("--target", action="append", help="name=url of a running load balancer, e.g. flask=http://localhost:8080/")
+    parser.add_argument("--local", action="store_true", help="start stub backends and the engines locally instead of using --target")
+    parser.add_argument("--engine", action="append", choices=list(ENGINES), help="engines to run with --local (default both)")
+    parser.add_argument("--backends", type=int, default=3, help="stub backends to start with --local")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="stub backend profile, e.g. delay_ms=20,jitter_ms=5,error_rate=0.01,payload_bytes=1024. "
+                             "repeat to give backends different profiles, they are assigned in turn")
+    parser.add_argument("--lb-env", action="append", default=[], help="NAME=value for the load balancer, e.g. BALANCING=p2c")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=50, help="clients in closed-loop mode")
+    parser.add_argument("--rps", type=float, default=200, help="request rate in open-loop mode")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    if args.local:
+        lb_env = dict(setting.split("=", 1) for setting in args.lb_env)
+        results = run_local(args.engine or list(ENGINES), args.backends, args.profile, lb_env,
+                            args.mode, args.concurrency, args.rps, args.duration)
+    elif args.target:
+        targets = [target.split("=", 1) for target in args.target]
+        results = asyncio.run(compare(targets, args.mode, args.concurrency, args.rps, args.duration))
+    else:
+        parser.error("give --target or --local")
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
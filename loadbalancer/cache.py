@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# statuses a shared cache may store when the response carries explicit freshness
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+
+class CacheEntry:
+    def __init__(self, status, headers, body, ttl, stale_while_revalidate):
+        now = time.monotonic()
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = now
+        self.fresh_until = now + ttl
+        self.stale_until = self.fresh_until + stale_while_revalidate
+        self.size = len(body) + sum(len(name) + len(value) for name, value in headers)
+
+    def age(self):
+        return int(time.monotonic() - self.stored_at)
+
+def parse_cache_control(value):
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"')
+    return directives
+
+def request_is_cacheable(method, headers):
+    if method != "GET" or "Authorization" in headers or "Range" in headers:
+        return False
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    return not ({"no-store", "no-cache"} & directives.keys() or directives.get("max-age") == "0")
+
+def freshness(status, headers):
+    """(ttl, stale-while-revalidate) in seconds from Cache-Control/Expires, or None if the response may not be stored.
+    headers is a case-insensitive mapping"""
+    if status not in CACHEABLE_STATUSES or "Set-Cookie" in headers:
+        return None
+    vary = {v.strip().lower() for v in headers.get("Vary", "").split(",") if v.strip()}
+    if vary - {"accept-encoding"}:
+        return None
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    if {"no-store", "no-cache", "private"} & directives.keys():
+        return None
+    try:
+        if "s-maxage" in directives:
+            ttl = int(directives["s-maxage"])
+        elif "max-age" in directives:
+            ttl = int(directives["max-age"])
+        elif "Expires" in headers:
+            date = parsedate_to_datetime(headers["Date"]).timestamp() if "Date" in headers else time.time()
+            ttl = parsedate_to_datetime(headers["Expires"]).timestamp() - date
+        else:
+            return None
+        ttl -= int(headers.get("Age", 0))
+        stale_while_revalidate = int(directives.get("stale-while-revalidate", 0))
+    except (TypeError, ValueError):
+        # an unparseable Expires means already expired
+        return None
+    if ttl <= 0 and stale_while_revalidate <= 0:
+        return None
+    return max(ttl, 0), stale_while_revalidate
+
+class ResponseCache:
+    """LRU cache of whole responses bounded by the bytes it holds"""
+    def __init__(self, max_bytes, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(path, headers):
+        # Vary: Accept-Encoding is the only Vary that gets stored, so it is always part of the key
+        return path, headers.get("Accept-Encoding", "")
+
+    def lookup(self, key):
+        """(entry, fresh). A stale entry is returned while it is inside its stale-while-revalidate window"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+            now = time.monotonic()
+            if now >= entry.stale_until:
+                self._remove(key)
+                return None, False
+            self.entries.move_to_end(key)
+            return entry, now < entry.fresh_until
+
+    def store(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return True
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key).size
+
+class Coalescer:
+    """runs one fetch per key at a time. Concurrent callers for the same key wait for it and share its result"""
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, fetch):
+        """fetch() returns (shared, private): shared goes to every waiter, private only to the caller that ran the fetch.
+        returns (shared, private, leader)"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None}
+        if not leader:
+            call["done"].wait()
+            return call["result"], None, False
+        try:
+            shared, private = fetch()
+            call["result"] = shared
+            return shared, private, True
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+    def in_flight(self, key):
+        return key in self.calls
+
+class AsyncCoalescer:
+    """Coalescer for the asyncio engine"""
+    def __init__(self):
+        self.calls = {}
+
+    async def run(self, key, fetch):
+        call = self.calls.get(key)
+        if call is not None:
+            return await asyncio.shield(call), None, False
+        call = self.calls[key] = asyncio.get_running_loop().create_future()
+        shared = None
+        try:
+            shared, private = await fetch()
+            return shared, private, True
+        finally:
+            del self.calls[key]
+            call.set_result(shared)
+
+    def in_flight(self, key):
+        return key in self.calls
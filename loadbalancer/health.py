@@ -0,0 +1,93 @@
+import collections
+import random
+import threading
+import time
+
+class HealthTracker:
+    """health of one backend from two sources.
+    active checks flip it healthy/unhealthy after a run of healthy_threshold/unhealthy_threshold results.
+    proxied responses eject it after `failures` consecutive failures, or when the error rate over the last
+    `window` responses reaches error_rate. An ejected backend stays out for a backoff that doubles with every
+    ejection, up to max_ejection, and comes back only once a probe (the next active check) passes"""
+    def __init__(self, healthy_threshold=1, unhealthy_threshold=1, failures=5, error_rate=0.5, window=20,
+                 base_ejection=5.0, max_ejection=120.0):
+        self.healthy_threshold = healthy_threshold
+        self.unhealthy_threshold = unhealthy_threshold
+        self.failures = failures
+        self.error_rate = error_rate
+        self.window = window
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+
+        self.healthy = True
+        self.consecutive_passes = 0
+        self.consecutive_fails = 0
+        self.consecutive_errors = 0
+        self.outcomes = collections.deque(maxlen=window)
+        self.ejected = False
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.readmitted_at = 0.0
+        self.lock = threading.Lock()
+
+    def available(self):
+        return self.healthy and not self.ejected
+
+    def record_check(self, ok):
+        """an active check result. Returns True if it changed whether the backend can take traffic"""
+        with self.lock:
+            was_available = self.healthy and not self.ejected
+            if ok:
+                self.consecutive_passes += 1
+                self.consecutive_fails = 0
+                if not self.healthy and self.consecutive_passes >= self.healthy_threshold:
+                    self.healthy = True
+            else:
+                self.consecutive_fails += 1
+                self.consecutive_passes = 0
+                if self.healthy and self.consecutive_fails >= self.unhealthy_threshold:
+                    self.healthy = False
+            if self.ejected and time.monotonic() >= self.ejected_until:
+                # half-open: this check is the probe
+                if ok:
+                    self._readmit()
+                else:
+                    self._eject()
+            return was_available != (self.healthy and not self.ejected)
+
+    def record_response(self, ok):
+        """a proxied request's outcome. Returns True if it got the backend ejected"""
+        with self.lock:
+            if self.ejected:
+                return False
+            self.outcomes.append(ok)
+            self.consecutive_errors = 0 if ok else self.consecutive_errors + 1
+            errors = self.outcomes.count(False)
+            if self.consecutive_errors >= self.failures or \
+                    (len(self.outcomes) == self.window and errors / self.window >= self.error_rate):
+                self._eject()
+                return True
+            return False
+
+    def _eject(self):
+        now = time.monotonic()
+        if not self.ejected and now - self.readmitted_at > self.max_ejection:
+            # it stayed in long enough since the last ejection, start the backoff over
+            self.ejections = 0
+        self.ejections += 1
+        self.ejected = True
+        self.ejected_until = now + min(self.base_ejection * 2 ** (self.ejections - 1), self.max_ejection)
+
+    def _readmit(self):
+        self.ejected = False
+        self.readmitted_at = time.monotonic()
+        self.outcomes.clear()
+        self.consecutive_errors = 0
+
+    def next_check_in(self, interval, jitter):
+        """seconds to the next active check: the jittered interval, or sooner if an ejection is due for its probe"""
+        delay = interval * random.uniform(1 - jitter, 1 + jitter)
+        with self.lock:
+            if self.ejected:
+                delay = min(delay, max(0.0, self.ejected_until - time.monotonic()))
+        return delay
@@ -1,95 +1,573 @@
-from flask import Flask, request, Response, jsonify
+from flask import Blueprint, Flask, request, Response, jsonify
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from http import cookiejar
+from balancing import create_strategy, PeakEWMALatency
+from health import HealthTracker
+from metrics import Metrics
+from cache import ResponseCache, CacheEntry, Coalescer, request_is_cacheable, freshness
+from admission import Admission, AdaptiveLimit
+from retries import RetryBudget, LatencyWindow, IDEMPOTENT_METHODS, RETRY_STATUSES
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
+import random
 import time
 import threading
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
 PORT = int(os.environ.get("PORT", 8080))
 BACKENDS = os.environ.get("BACKENDS", "").split(",")
 HEALTH_INTERVAL = int(os.environ.get("HEALTH_INTERVAL", 5))
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 10))
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 30))
+POOL_TIMEOUT = float(os.environ.get("POOL_TIMEOUT", 1))
+STREAMING = os.environ.get("STREAMING", "true").lower() in ("1", "true", "yes")
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 64 * 1024))
+BALANCING = os.environ.get("BALANCING", "round-robin")
+BACKEND_WEIGHTS = [int(w) for w in os.environ.get("BACKEND_WEIGHTS", "").split(",") if w]
+EWMA_DECAY = float(os.environ.get("EWMA_DECAY", 10))
+HASH_KEY = os.environ.get("HASH_KEY", "client-ip")
+HASH_LOAD_FACTOR = float(os.environ.get("HASH_LOAD_FACTOR", 1.25))
+HEALTH_TIMEOUT = float(os.environ.get("HEALTH_TIMEOUT", 2))
+HEALTH_JITTER = float(os.environ.get("HEALTH_JITTER", 0.1))
+HEALTHY_THRESHOLD = int(os.environ.get("HEALTHY_THRESHOLD", 1))
+UNHEALTHY_THRESHOLD = int(os.environ.get("UNHEALTHY_THRESHOLD", 1))
+EJECT_FAILURES = int(os.environ.get("EJECT_FAILURES", 5))
+EJECT_ERROR_RATE = float(os.environ.get("EJECT_ERROR_RATE", 0.5))
+EJECT_WINDOW = int(os.environ.get("EJECT_WINDOW", 20))
+EJECT_BASE_TIME = float(os.environ.get("EJECT_BASE_TIME", 5))
+EJECT_MAX_TIME = float(os.environ.get("EJECT_MAX_TIME", 120))
+CACHE_BYTES = int(os.environ.get("CACHE_BYTES", 0))
+CACHE_MAX_ENTRY_BYTES = int(os.environ.get("CACHE_MAX_ENTRY_BYTES", 0)) or None
+TRY_TIMEOUT = float(os.environ.get("TRY_TIMEOUT", 10)) or None
+RETRIES = int(os.environ.get("RETRIES", 1))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", 10))
+HEDGING = os.environ.get("HEDGING", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.005))
+RATE_LIMIT = float(os.environ.get("RATE_LIMIT", 0))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 0))
+CLIENT_RATE_LIMIT = float(os.environ.get("CLIENT_RATE_LIMIT", 0))
+CLIENT_RATE_LIMIT_BURST = float(os.environ.get("CLIENT_RATE_LIMIT_BURST", 0))
+CLIENT_KEY = os.environ.get("CLIENT_KEY", "client-ip")
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 0))
+MAX_BACKEND_IN_FLIGHT = int(os.environ.get("MAX_BACKEND_IN_FLIGHT", 0))
+ADAPTIVE_CONCURRENCY = os.environ.get("ADAPTIVE_CONCURRENCY", "false").lower() in ("1", "true", "yes")
+ADAPTIVE_MIN_LIMIT = int(os.environ.get("ADAPTIVE_MIN_LIMIT", 5))
+ADAPTIVE_MAX_LIMIT = int(os.environ.get("ADAPTIVE_MAX_LIMIT", 1000))
+ADAPTIVE_TOLERANCE = float(os.environ.get("ADAPTIVE_TOLERANCE", 2.0))
+
+PROXY_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+                      "te", "trailer", "trailers", "transfer-encoding", "upgrade"}
+
+class IdleTimeoutMixin:
+    """closes a pooled connection on checkout once it has been idle longer than IDLE_TIMEOUT.
+    requests never passes a pool timeout, so waiting for a free connection is capped at POOL_TIMEOUT here"""
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(POOL_TIMEOUT if timeout is None else timeout)
+        idle_since = getattr(conn, "idle_since", None)
+        if idle_since is not None and time.monotonic() - idle_since > IDLE_TIMEOUT:
+            # the backend may have dropped it already, reconnect instead of risking a reset
+            conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.idle_since = time.monotonic()
+        super()._put_conn(conn)
+
+class KeepAliveHTTPConnectionPool(IdleTimeoutMixin, HTTPConnectionPool):
+    pass
+
+class KeepAliveHTTPSConnectionPool(IdleTimeoutMixin, HTTPSConnectionPool):
+    pass
+
+class KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": KeepAliveHTTPConnectionPool,
+            "https": KeepAliveHTTPSConnectionPool
+        }
+
+class BlockAllCookies(cookiejar.CookiePolicy):
+    """the session is shared by all clients, so backend cookies must never be stored in it"""
+    return_ok = set_ok = domain_return_ok = path_return_ok = lambda self, *args, **kwargs: False
+    netscape = True
+    rfc2965 = hide_cookie2 = False
 
 class Backend:
-    def __init__(self, url):
+    def __init__(self, url, weight=1, max_connections=MAX_CONNECTIONS, max_in_flight=MAX_BACKEND_IN_FLIGHT):
         self.url = url
-        self.healthy = True
+        self.weight = weight
+        self.max_in_flight = max_in_flight
+        self.health = HealthTracker(HEALTHY_THRESHOLD, UNHEALTHY_THRESHOLD, EJECT_FAILURES, EJECT_ERROR_RATE,
+                                    EJECT_WINDOW, EJECT_BASE_TIME, EJECT_MAX_TIME)
         self.last_check = None
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.latency = PeakEWMALatency(EWMA_DECAY)
+        # one keep-alive pool per backend, at most max_connections open at a time
+        self.session = requests.Session()
+        self.session.cookies.set_policy(BlockAllCookies())
+        adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def healthy(self):
+        return self.health.healthy
+
+    def available(self):
+        return self.health.available()
+
+    def full(self):
+        return bool(self.max_in_flight) and self.in_flight >= self.max_in_flight
+
+    def start_request(self):
+        """False, and nothing is counted, if the backend is already at max_in_flight"""
+        with self.in_flight_lock:
+            if self.full():
+                return False
+            self.in_flight += 1
+            return True
+
+    def end_request(self):
+        with self.in_flight_lock:
+            self.in_flight -= 1
+
+    def observe_latency(self, latency):
+        self.latency.observe(latency)
 
 class LoadBalancer:
-    def __init__(self, backend_urls, health_check_interval=5):
-        self.backends = [Backend(url) for url in backend_urls]
+    def __init__(self, backend_urls, health_check_interval=5, strategy="round-robin", weights=None, hash_load_factor=1.25,
+                 cache_bytes=0, cache_max_entry_bytes=None):
+        weights = weights or [1] * len(backend_urls)
+        if len(weights) != len(backend_urls):
+            raise ValueError(f"{len(weights)} weights given for {len(backend_urls)} backends")
+        self.backends = [Backend(url, weight) for url, weight in zip(backend_urls, weights)]
         self.health_check_interval = health_check_interval
-        self.current_index = 0
-        self.lock = threading.Lock()
-
-    def get_next_backend(self):
-        with self.lock:
-            healthy_backends = [b for b in self.backends if b.healthy]
-            if not healthy_backends:
-                return None
-            self.current_index = self.current_index % len(healthy_backends)
-            backend = healthy_backends[self.current_index]
-            self.current_index +=1
-            return backend
+        self.strategy = create_strategy(strategy, hash_load_factor)
+        self.metrics = Metrics()
+        self.cache = ResponseCache(cache_bytes, cache_max_entry_bytes) if cache_bytes else None
+        self.retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND)
+        self.latencies = LatencyWindow()
+        adaptive = AdaptiveLimit(min_limit=ADAPTIVE_MIN_LIMIT, max_limit=ADAPTIVE_MAX_LIMIT,
+                                 tolerance=ADAPTIVE_TOLERANCE) if ADAPTIVE_CONCURRENCY else None
+        self.admission = Admission(RATE_LIMIT, RATE_LIMIT_BURST, CLIENT_RATE_LIMIT, CLIENT_RATE_LIMIT_BURST,
+                                   MAX_IN_FLIGHT, adaptive)
+
+    def get_next_backend(self, key=None, exclude=()):
+        available = [b for b in self.backends if b.available()]
+        candidates = [b for b in available if b not in exclude and not b.full()]
+        if not candidates:
+            return None
+        return self.strategy.choose(candidates, key, available)
+
+    def record_check(self, backend, ok):
+        backend.last_check = time.time()
+        if backend.health.record_check(ok):
+            self.metrics.inc("health_transitions", backend.url, "up" if backend.available() else "down")
+            logger.warning(f"backend : {backend.url} -> available: {backend.available()}")
+        logger.info(f"backend : {backend.url} -> healthy: {backend.healthy}")
+
+    def record_response(self, backend, status, latency):
+        """status is None when the backend could not be reached"""
+        backend.observe_latency(latency)
+        self.metrics.observe_latency(backend.url, latency)
+        self.metrics.inc("requests", backend.url, f"{status // 100}xx" if status else "error")
+        if status is not None and status < 500:
+            self.latencies.record(latency)
+        if self.admission.adaptive is not None:
+            self.admission.adaptive.observe(latency, status is not None and status < 500)
+        if backend.health.record_response(status is not None and status < 500):
+            self.metrics.inc("ejections", backend.url)
+            self.metrics.inc("health_transitions", backend.url, "down")
+            logger.warning(f"backend : {backend.url} ejected for {backend.health.ejected_until - time.monotonic():.1f}s")
+
+    def backend_limit_reached(self):
+        """the error for a request turned away because the backends it could go to are all at MAX_BACKEND_IN_FLIGHT"""
+        self.metrics.inc("rejected", None, "backend_concurrency")
+        return ProxyError(503, "backend_concurrency limit exceeded")
+
+    def no_backend(self):
+        """the error for a request that found no backend for its first try"""
+        if any(b.available() for b in self.backends):
+            return self.backend_limit_reached()
+        return ProxyError(503, "no healthy backends")
+
+    def hedge_delay(self):
+        """how long the first try gets before a hedge is sent: the recent HEDGE_PERCENTILE latency, None until known"""
+        latency = self.latencies.percentile(HEDGE_PERCENTILE)
+        return None if latency is None else max(latency, HEDGE_MIN_DELAY)
 
     def check_health(self, backend):
         try:
             logger.info(f"health check for {backend.url}")
-            resp = requests.get(f"{backend.url}/health", timeout=2)
-            backend.healthy = resp.status_code == 200
+            resp = backend.session.get(f"{backend.url}/health", timeout=HEALTH_TIMEOUT)
+            ok = resp.status_code == 200
         except requests.exceptions.RequestException as e:
-            backend.healthy = False
-            
-        backend.last_check = time.time()
-        logger.info("backend : {backend.url} -> healthy: {backend.healthy}")
+            ok = False
+        self.record_check(backend, ok)
+
+    def status(self):
+        return {
+            "backends": [{"url": b.url, "healthy": b.healthy, "ejected": b.health.ejected, "ejections": b.health.ejections,
+                          "last_check": b.last_check, "weight": b.weight,
+                          "in_flight": b.in_flight, "latency_ewma_ms": b.latency.value() * 1000} for b in self.backends]
+        }
 
-    def health_check_loop(self):
+    def health_check_loop(self, backend):
+        # every backend is checked on its own jittered schedule, so a dead one never delays the others
+        time.sleep(random.uniform(0, self.health_check_interval))
         while True:
-            for backend in self.backends:
-                self.check_health(backend)
-            time.sleep(self.health_check_interval)
+            self.check_health(backend)
+            time.sleep(backend.health.next_check_in(self.health_check_interval, HEALTH_JITTER))
 
     def start_health_checks(self):
         logger.info("health check loop started")
-        thread = threading.Thread(target=self.health_check_loop, daemon=True)
-        thread.start()
+        for backend in self.backends:
+            thread = threading.Thread(target=self.health_check_loop, args=(backend,), daemon=True)
+            thread.start()
     
 
-lb = LoadBalancer(BACKENDS, HEALTH_INTERVAL)
+class ProxyError(Exception):
+    """no usable response from any backend"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class RequestBody:
+    """streams the client body upstream chunk by chunk. Without a length, requests sends it chunked"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.sent = 0
+
+    def __iter__(self):
+        while True:
+            chunk = self.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.sent += len(chunk)
+            yield chunk
+
+class SizedRequestBody(RequestBody):
+    """a streamed body that keeps the client's Content-Length"""
+    def __init__(self, stream, length):
+        super().__init__(stream)
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+def strip_hop_by_hop(headers, extra=()):
+    """drops hop-by-hop headers, including the ones named in the Connection header"""
+    headers = list(headers)
+    drop = HOP_BY_HOP_HEADERS | {h.lower() for h in extra}
+    for name, value in headers:
+        if name.lower() == "connection":
+            drop |= {token.strip().lower() for token in value.split(",")}
+    return [(name, value) for name, value in headers if name.lower() not in drop]
+
+def request_key(spec, remote_addr, headers, cookies):
+    """a key taken from the request as the spec says: client-ip, header:<name> or cookie:<name>"""
+    source, _, name = spec.partition(":")
+    if source == "header":
+        return headers.get(name)
+    if source == "cookie":
+        return cookies.get(name)
+    return remote_addr
 
-@app.route("/")
-def proxy():
-    backend = lb.get_next_backend()
-    logging.info(f"forwarding request to {backend}")
+def routing_key(remote_addr, headers, cookies):
+    """the sticky routing key, from HASH_KEY"""
+    return request_key(HASH_KEY, remote_addr, headers, cookies)
 
-    if not backend:
-        return Response("no healthy backends", status=503)
+def client_key(remote_addr, headers, cookies):
+    """who a request counts against for the per-client rate limit, from CLIENT_KEY"""
+    return request_key(CLIENT_KEY, remote_addr, headers, cookies)
+
+def upstream_body():
+    if not STREAMING:
+        return request.get_data()
+    if request.content_length is not None:
+        return SizedRequestBody(request.stream, request.content_length)
+    if "chunked" in request.headers.get("Transfer-Encoding", "").lower():
+        return RequestBody(request.stream)
+    return None
+
+def body_size(body):
+    return body.sent if isinstance(body, RequestBody) else len(body or b"")
+
+def upstream_path():
+    path = request.path
+    if request.query_string:
+        path = f"{path}?{request.query_string.decode('latin-1')}"
+    return path
+
+def upstream_headers():
+    # requests frames the body itself, so the client's framing headers are not forwarded
+    return dict(strip_hop_by_hop(request.headers, extra=("host", "content-length")))
+
+def relay(resp, backend, first_chunk=b""):
+    if first_chunk:
+        lb.metrics.inc("response_bytes", backend.url, value=len(first_chunk))
+        yield first_chunk
+    for chunk in resp.raw.stream(CHUNK_SIZE, decode_content=False):
+        lb.metrics.inc("response_bytes", backend.url, value=len(chunk))
+        yield chunk
+
+def send(backend, method, path, headers, body=None):
+    """the upstream response with its body unread, or None if the backend could not be reached.
+    raises ProxyError(503) when the backend is at MAX_BACKEND_IN_FLIGHT or every pooled connection
+    to it stays busy for POOL_TIMEOUT"""
+    if not backend.start_request():
+        # another request took the backend's last slot after it was picked
+        raise lb.backend_limit_reached()
+    start = time.perf_counter()
     try:
-        resp = requests.request(
-            method = request.method,
-            url=backend.url,
-            headers={k: v for k, v in request.headers if k.lower()!= "host"},    
-            data=request.get_data(),
-            allow_redirects=False
+        resp = backend.session.request(
+            method = method,
+            url=f"{backend.url}{path}",
+            headers=headers,
+            data=body,
+            allow_redirects=False,
+            stream=True,
+            timeout=TRY_TIMEOUT
         )
-        return Response(resp.content, status=resp.status_code, headers=dict(resp.headers))
-
+    except EmptyPoolError:
+        # the proxy is out of connections, not the backend failing, so it is not held against its health
+        backend.end_request()
+        lb.metrics.inc("pool_timeouts", backend.url)
+        logger.warning(f"no free connection to {backend.url} within {POOL_TIMEOUT}s")
+        raise ProxyError(503, "no free connection to the backend")
     except requests.exceptions.RequestException as e:
+        backend.end_request()
+        lb.record_response(backend, None, time.perf_counter() - start)
         logger.error(f"Backend {backend} failed: {e}")
-        return Response("backend unavailable", status=502)
+        return None
+    lb.record_response(backend, resp.status_code, time.perf_counter() - start)
+    lb.metrics.inc("request_bytes", backend.url, value=body_size(body))
+    return resp
+
+def discard(resp, backend):
+    resp.close()
+    backend.end_request()
+
+def usable(resp):
+    return resp is not None and resp.status_code not in RETRY_STATUSES
+
+def outcome(future):
+    """the response of a hedged attempt, None if it failed or raised"""
+    return None if future.exception() is not None else future.result()
+
+def hedge(first, tried, hash_key, method, path, headers, body):
+    """sends to first, and to a second backend as well if first has not answered within the hedge delay.
+    returns (backend, resp) for the first usable response. The other one is discarded when it arrives"""
+    delay = lb.hedge_delay()
+    attempts = {hedge_pool.submit(send, first, method, path, headers, body): first}
+    done, _ = wait(attempts, timeout=delay)
+    if not done:
+        second = lb.get_next_backend(hash_key, exclude=tried)
+        if second is not None and lb.retry_budget.withdraw():
+            tried.append(second)
+            lb.metrics.inc("hedges", first.url)
+            attempts[hedge_pool.submit(send, second, method, path, headers, body)] = second
+    pending = set(attempts)
+    winner = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # a usable response wins over an unusable one that finished in the same batch
+        for future in sorted(done, key=lambda f: not usable(outcome(f))):
+            if winner is None and (usable(outcome(future)) or not pending):
+                winner = future
+            elif outcome(future) is not None:
+                discard(outcome(future), attempts[future])
+        if winner is not None:
+            break
+    for future in pending:
+        future.add_done_callback(lambda f, backend=attempts[future]: outcome(f) is not None and discard(outcome(f), backend))
+    return attempts[winner], winner.result()
+
+def dispatch(method, path, headers, body, hash_key):
+    """sends the request, retrying idempotent ones on other backends within the retry budget.
+    returns (backend, resp) with the body unread, or raises ProxyError. When no retry can follow,
+    the backend's own error response is returned rather than a generated one"""
+    # a streamed body is gone after the first try, so only buffered or empty bodies can be sent again
+    replayable = method in IDEMPOTENT_METHODS and not isinstance(body, RequestBody)
+    tries = 1 + RETRIES if replayable else 1
+    tried = []
+    last = None
+    lb.retry_budget.record_request()
+    try:
+        for attempt in range(tries):
+            backend = lb.get_next_backend(hash_key, exclude=tried)
+            if backend is None:
+                break
+            if attempt > 0:
+                if not lb.retry_budget.withdraw():
+                    break
+                lb.metrics.inc("retries", tried[-1].url)
+            tried.append(backend)
+            logging.info(f"forwarding request to {backend.url}")
+            if replayable and HEDGING and lb.hedge_delay() is not None:
+                backend, resp = hedge(backend, tried, hash_key, method, path, headers, body)
+            else:
+                resp = send(backend, method, path, headers, body)
+            if resp is None:
+                continue
+            if last is not None:
+                discard(last[1], last[0])
+            last = (backend, resp)
+            if usable(resp):
+                return last
+    except ProxyError:
+        if last is None:
+            raise
+    except BaseException:
+        if last is not None:
+            discard(last[1], last[0])
+        raise
+    if last is not None:
+        return last
+    if not tried:
+        raise lb.no_backend()
+    raise ProxyError(502, "backend unavailable")
+
+def response_headers(resp):
+    # the raw body is relayed undecoded, so Content-Length and Content-Encoding stay valid.
+    # the server in front sets its own Server and Date headers
+    return strip_hop_by_hop(resp.raw.headers.items(), extra=("server", "date"))
+
+def stream_response(resp, backend, first_chunk=b""):
+    response = Response(relay(resp, backend, first_chunk), status=resp.status_code, headers=response_headers(resp))
+    response.call_on_close(resp.close)
+    # the request stays in flight until the client has the whole body
+    response.call_on_close(backend.end_request)
+    return response
+
+def forward():
+    hash_key = routing_key(request.remote_addr, request.headers, request.cookies)
+    try:
+        backend, resp = dispatch(request.method, upstream_path(), upstream_headers(), upstream_body(), hash_key)
+    except ProxyError as e:
+        return Response(e.message, status=e.status)
+    if STREAMING:
+        return stream_response(resp, backend)
+    try:
+        body = resp.raw.read(decode_content=False)
+    finally:
+        discard(resp, backend)
+    lb.metrics.inc("response_bytes", backend.url, value=len(body))
+    return Response(body, status=resp.status_code, headers=response_headers(resp))
+
+def fetch_into_cache(key, path, headers, hash_key):
+    """fetches a cacheable GET. Returns (entry, None) if the response was stored, otherwise (None, response)
+    with the response for the caller alone"""
+    try:
+        backend, resp = dispatch("GET", path, headers, None, hash_key)
+    except ProxyError as e:
+        return None, Response(e.message, status=e.status)
+    lifetime = freshness(resp.status_code, resp.headers)
+    length = resp.headers.get("Content-Length")
+    if lifetime is None or (length is not None and int(length) > lb.cache.max_entry_bytes):
+        return None, stream_response(resp, backend)
+    body = resp.raw.read(lb.cache.max_entry_bytes + 1, decode_content=False)
+    if len(body) > lb.cache.max_entry_bytes:
+        # no Content-Length and too big after all, send on what is read and stream the rest
+        return None, stream_response(resp, backend, body)
+    discard(resp, backend)
+    lb.metrics.inc("response_bytes", backend.url, value=len(body))
+    entry = CacheEntry(resp.status_code, cache_headers(response_headers(resp)), body, *lifetime)
+    if not lb.cache.store(key, entry):
+        return None, cached_response(entry)
+    return entry, None
+
+def cache_headers(headers):
+    # Age is worked out when the entry is served, and Content-Length by the server
+    return [(name, value) for name, value in headers if name.lower() not in ("age", "content-length")]
+
+def cached_response(entry):
+    return Response(entry.body, status=entry.status, headers=entry.headers + [("Age", str(entry.age()))])
+
+def revalidate(key, path, headers, hash_key):
+    _, response, _ = coalescer.run(key, lambda: fetch_into_cache(key, path, headers, hash_key))
+    if response is not None:
+        # nobody is waiting for it, just release the upstream connection
+        response.close()
+
+def cached_proxy():
+    key = lb.cache.key(upstream_path(), request.headers)
+    hash_key = routing_key(request.remote_addr, request.headers, request.cookies)
+    entry, fresh = lb.cache.lookup(key)
+    if entry is not None:
+        if not fresh and not coalescer.in_flight(key):
+            # stale-while-revalidate: serve it now and refresh it in the background
+            threading.Thread(target=revalidate, args=(key, upstream_path(), upstream_headers(), hash_key), daemon=True).start()
+        lb.metrics.inc("cache", None, "hit" if fresh else "stale")
+        return cached_response(entry)
+
+    entry, response, leader = coalescer.run(key, lambda: fetch_into_cache(key, upstream_path(), upstream_headers(), hash_key))
+    lb.metrics.inc("cache", None, "miss" if leader else "coalesced")
+    if entry is not None:
+        return cached_response(entry)
+    if response is not None:
+        return response
+    # the response we waited for could not be shared
+    return forward()
+
+# the Flask engine's state, set up by create_app so that importing this module (as the async engine does) starts nothing
+lb = None
+coalescer = None
+hedge_pool = None
+routes = Blueprint("proxy", __name__)
+
+def create_app():
+    global lb, coalescer, hedge_pool
+    lb = LoadBalancer(BACKENDS, HEALTH_INTERVAL, BALANCING, BACKEND_WEIGHTS, HASH_LOAD_FACTOR, CACHE_BYTES, CACHE_MAX_ENTRY_BYTES)
+    coalescer = Coalescer()
+    hedge_pool = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS * max(len(BACKENDS), 1))
+    app = Flask(__name__)
+    app.register_blueprint(routes)
+    return app
+
+@routes.route("/", defaults={"path": ""}, methods=PROXY_METHODS)
+@routes.route("/<path:path>", methods=PROXY_METHODS)
+def proxy(path):
+    rejection = lb.admission.admit(client_key(request.remote_addr, request.headers, request.cookies))
+    if rejection is not None:
+        status, reason = rejection
+        lb.metrics.inc("rejected", None, reason)
+        return Response(f"{reason} limit exceeded", status=status, headers={"Retry-After": "1"})
+    try:
+        if lb.cache is not None and request_is_cacheable(request.method, request.headers):
+            response = cached_proxy()
+        else:
+            response = forward()
+    except BaseException:
+        lb.admission.release()
+        raise
+    # admitted until the client has the whole response
+    response.call_on_close(lb.admission.release)
+    return response
+
+@routes.route("/lb/metrics")
+def lbmetrics():
+    return Response(lb.metrics.render(lb.backends, lb.cache, lb.admission), content_type="text/plain; version=0.0.4")
 
-@app.route("/lb/status")
+@routes.route("/lb/status")
 def lbstatus():
-    return jsonify({
-        "backends": [{"url": b.url, "healthy": b.healthy, "last_check": b.last_check} for b in lb.backends]
-    })
+    return jsonify(lb.status())
 
 if __name__ == '__main__':
+    app = create_app()
     logger.info(f"load balancer starting on port {PORT} ")
     logger.info(f"list of backends {BACKENDS}")
     lb.start_health_checks()
@@ -0,0 +1,127 @@
+import bisect
+import collections
+import itertools
+import threading
+import weakref
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = {
+    "request_bytes": "request body bytes sent to the backend",
+    "response_bytes": "response body bytes received from the backend",
+    "retries": "requests retried on another backend after failing on this one",
+    "hedges": "hedged requests sent to a second backend because this one was slow",
+    "ejections": "passive outlier ejections",
+    "pool_timeouts": "requests answered 503 because no connection to the backend freed up within POOL_TIMEOUT"
+}
+
+class ThreadShard:
+    """lives in a thread's thread-local, it is freed when the thread exits"""
+    __slots__ = ("__weakref__",)
+
+class Metrics:
+    """counters kept per thread, so the proxy never takes a shared lock to count.
+    a scrape adds up the threads' counters. When a thread exits its counters are folded into `retired`
+    straight away, so the thread-per-request flask server does not grow the shard list between scrapes"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.local = threading.local()
+        self.shards = {}
+        self.shard_ids = itertools.count()
+        self.retired = collections.Counter()
+        self.lock = threading.Lock()
+
+    def _counters(self):
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = collections.defaultdict(int)
+            shard_id = next(self.shard_ids)
+            # a single dict store is atomic under the GIL, registering needs no lock either
+            self.shards[shard_id] = counters
+            self.local.counters = counters
+            self.local.shard = ThreadShard()
+            weakref.finalize(self.local.shard, self._retire, shard_id).atexit = False
+            return counters
+
+    def _retire(self, shard_id):
+        with self.lock:
+            self.retired.update(self.shards.pop(shard_id))
+
+    def inc(self, name, backend, label=None, value=1):
+        self._counters()[(name, backend, label)] += value
+
+    def observe_latency(self, backend, seconds):
+        counters = self._counters()
+        counters[("latency_bucket", backend, bisect.bisect_left(self.buckets, seconds))] += 1
+        counters[("latency_sum", backend, None)] += seconds
+
+    def totals(self):
+        totals = collections.Counter()
+        with self.lock:
+            # copy() runs under the GIL, so it is a consistent view of a dict another thread is updating
+            for counters in self.shards.copy().values():
+                totals.update(counters.copy())
+            totals.update(self.retired)
+        return totals
+
+    def render(self, backends, cache=None, admission=None):
+        """prometheus text exposition format"""
+        totals = self.totals()
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP lb_{name} {help_text}")
+            lines.append(f"# TYPE lb_{name} {kind}")
+
+        family("requests_total", "counter", "proxied requests by response status class")
+        for (_, backend, code), value in sorted(item for item in totals.items() if item[0][0] == "requests"):
+            lines.append(f'lb_requests_total{{backend="{backend}",code="{code}"}} {value}')
+
+        for name, help_text in COUNTERS.items():
+            family(f"{name}_total", "counter", help_text)
+            for b in backends:
+                lines.append(f'lb_{name}_total{{backend="{b.url}"}} {totals[(name, b.url, None)]}')
+
+        family("health_transitions_total", "counter", "times the backend went in or out of rotation")
+        for b in backends:
+            for to in ("up", "down"):
+                lines.append(f'lb_health_transitions_total{{backend="{b.url}",to="{to}"}} {totals[("health_transitions", b.url, to)]}')
+
+        family("in_flight", "gauge", "requests currently being proxied to the backend")
+        for b in backends:
+            lines.append(f'lb_in_flight{{backend="{b.url}"}} {b.in_flight}')
+
+        family("backend_available", "gauge", "1 if the backend is healthy and not ejected")
+        for b in backends:
+            lines.append(f'lb_backend_available{{backend="{b.url}"}} {int(b.available())}')
+
+        family("upstream_latency_seconds", "histogram", "time from sending the request to the backend's response headers")
+        for b in backends:
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += totals[("latency_bucket", b.url, index)]
+                lines.append(f'lb_upstream_latency_seconds_bucket{{backend="{b.url}",le="{bound}"}} {cumulative}')
+            cumulative += totals[("latency_bucket", b.url, len(self.buckets))]
+            lines.append(f'lb_upstream_latency_seconds_bucket{{backend="{b.url}",le="+Inf"}} {cumulative}')
+            lines.append(f'lb_upstream_latency_seconds_sum{{backend="{b.url}"}} {totals[("latency_sum", b.url, None)]}')
+            lines.append(f'lb_upstream_latency_seconds_count{{backend="{b.url}"}} {cumulative}')
+
+        if cache is not None:
+            family("cache_requests_total", "counter", "cacheable requests by result: hit, stale, miss or coalesced")
+            for result in ("hit", "stale", "miss", "coalesced"):
+                lines.append(f'lb_cache_requests_total{{result="{result}"}} {totals[("cache", None, result)]}')
+            family("cache_bytes", "gauge", "bytes held by the response cache")
+            lines.append(f"lb_cache_bytes {cache.bytes}")
+
+        if admission is not None:
+            family("rejected_requests_total", "counter", "requests turned away by admission control, by limit")
+            for reason in ("rate", "client_rate", "concurrency", "backend_concurrency"):
+                lines.append(f'lb_rejected_requests_total{{reason="{reason}"}} {totals[("rejected", None, reason)]}')
+            family("admitted_in_flight", "gauge", "admitted requests not finished yet")
+            lines.append(f"lb_admitted_in_flight {admission.in_flight}")
+            limit = admission.limit()
+            if limit is not None:
+                family("concurrency_limit", "gauge", "current in-flight limit, the lower of MAX_IN_FLIGHT and the adaptive limit")
+                lines.append(f"lb_concurrency_limit {limit}")
+        return "\n".join(lines) + "\n"
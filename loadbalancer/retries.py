@@ -0,0 +1,65 @@
+import collections
+import threading
+import time
+
+# methods that can safely be sent twice (RFC 9110)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+# responses that say this backend could not serve it, another one might
+RETRY_STATUSES = {502, 503, 504}
+
+class RetryBudget:
+    """caps retries (and hedges) to a fraction of the traffic, so during an outage they cannot multiply the load.
+    every request deposits `ratio` tokens, every retry takes one. min_per_second tokens a second are granted on top
+    so that a quiet load balancer can still retry"""
+    def __init__(self, ratio=0.2, min_per_second=10, max_tokens=100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = min_per_second
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, deposit):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + deposit + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+
+    def record_request(self):
+        with self.lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            self._refill(0)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class LatencyWindow:
+    """the last `size` upstream latencies, for the hedging delay"""
+    def __init__(self, size=1000, min_samples=50, refresh_interval=1.0):
+        self.samples = collections.deque(maxlen=size)
+        self.min_samples = min_samples
+        self.refresh_interval = refresh_interval
+        self.cached = {}
+        self.cached_at = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, p):
+        """None until there are min_samples latencies. Recomputed at most once per refresh_interval"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.cached_at > self.refresh_interval:
+                self.cached = {}
+                self.cached_at = now
+            if p not in self.cached:
+                if len(self.samples) < self.min_samples:
+                    return None
+                ordered = sorted(self.samples)
+                self.cached[p] = ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+            return self.cached[p]
@@ -2,19 +2,34 @@ from flask import Flask, jsonify
 import socket
 from datetime import datetime
 import os
+import random
+import time
 
 app = Flask(__name__)
 
 SERVICE_ID = os.environ.get("SERVICE_ID", socket.gethostname())
 PORT = int(os.environ.get("PORT", 5000))
+# stub profile for benchmarks, all off by default
+DELAY_MS = float(os.environ.get("DELAY_MS", 0))
+DELAY_JITTER_MS = float(os.environ.get("DELAY_JITTER_MS", 0))
+ERROR_RATE = float(os.environ.get("ERROR_RATE", 0))
+PAYLOAD_BYTES = int(os.environ.get("PAYLOAD_BYTES", 0))
 
 @app.route("/")
 def index():
-    return jsonify({
+    delay = DELAY_MS + random.uniform(-DELAY_JITTER_MS, DELAY_JITTER_MS)
+    if delay > 0:
+        time.sleep(delay / 1000)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return jsonify({"service_id": SERVICE_ID, "error": "injected"}), 500, {"X-Service-Id": SERVICE_ID}
+    body = {
         "service_id": SERVICE_ID,
         "port": PORT,
         "timestamp": datetime.now().isoformat()
-    })
+    }
+    if PAYLOAD_BYTES:
+        body["payload"] = "x" * PAYLOAD_BYTES
+    return jsonify(body), 200, {"X-Service-Id": SERVICE_ID}
 
 @app.route("/health")
 def health():
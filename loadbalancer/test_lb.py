@@ -169,7 +169,8 @@ def test_health_check():
     log_info("Test health check by bringing down backend-2")
     run('docker compose stop backend-2')
     
-    time.sleep(int(os.environ.get("HEALTH_INTERVAL", 5)))
+    # checks run on a jittered schedule, allow for the jitter and the check itself
+    time.sleep(int(os.environ.get("HEALTH_INTERVAL", 5)) + 2)
     try:
         resp = requests.get(f"{LB_URL}/lb/status", timeout=2)
         data = resp.json()
@@ -208,7 +209,8 @@ def test_traffic_avoid_unhealthy():
 def test_backend_recovery():
     log_info("Test backend-2 recovers after restart")
     run("docker compose start backend-2")
-    time.sleep(int(os.environ.get("HEALTH_INTERVAL", 5)))
+    # checks run on a jittered schedule, allow for the jitter and the check itself
+    time.sleep(int(os.environ.get("HEALTH_INTERVAL", 5)) + 2)
     try:
         resp = requests.get(f"{LB_URL}/lb/status", timeout=2)
         data = resp.json()